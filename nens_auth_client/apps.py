@@ -7,7 +7,9 @@ class NensAuthClientConfig(AppConfig):
     verbose_name = "N&S authentication client"
 
     def ready(self):
-        # Perform system checks
+        # Perform system checks and connect the signals that invalidate the
+        # user cache
         from nens_auth_client import checks  # NOQA
+        from nens_auth_client import user_cache  # NOQA
 
         return super().ready()
@@ -1,4 +1,8 @@
 from .oauth import get_oauth_client
+from .user_cache import aget_cached_user
+from .user_cache import aset_cached_user
+from .user_cache import get_cached_user
+from .user_cache import set_cached_user
 from .users import create_remote_user
 from .users import create_user
 from .users import found_or_wildcard
@@ -8,6 +12,10 @@ from django.contrib.auth.backends import ModelBackend
 from django.core.exceptions import MultipleObjectsReturned
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.exceptions import PermissionDenied
+from django.db.models import Value
+from django.db.models.functions import Lower
+from django.utils.module_loading import import_string
+from functools import partial
 
 import logging
 
@@ -16,6 +24,25 @@ logger = logging.getLogger(__name__)
 UserModel = get_user_model()
 
 
+def _lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def _user_queryset():
+    """Return the User QuerySet that the backend lookups are applied to.
+
+    It has the aliases "nens_auth_username_lower" and "nens_auth_email_lower"
+    for LOWER(username) and LOWER(email). Contrary to "field__iexact", lookups
+    on these can use an index (see nens_auth_client.user_indexes).
+    """
+    queryset = UserModel.objects.all()
+    alias = getattr(queryset, "alias", queryset.annotate)  # Django < 3.2
+    return alias(
+        nens_auth_username_lower=Lower("username"),
+        nens_auth_email_lower=Lower("email"),
+    )
+
+
 class RemoteUserBackend(ModelBackend):
     def authenticate(self, request, claims):
         """Authenticate a token through an existing RemoteUser
@@ -23,24 +50,68 @@ class RemoteUserBackend(ModelBackend):
         Unlike the django ModelBackend, this backend raises a PermissionDenied
         if the user is inactive.
 
+        Users are optionally cached by "sub" claim (see
+        NENS_AUTH_USER_CACHE_TIMEOUT).
+
+        Args:
+          request: the current request
+          claims (dict): the verified payload of the ID or Access token
+
+        Returns:
+          user or None
+        """
+        lookup = self.get_lookup(claims)
+        return self.resolve(request, claims, lambda: _user_queryset().get(**lookup))
+
+    def get_lookup(self, claims):
+        """Return the keyword arguments to look up the user with"""
+        return {"remote__external_user_id": claims["sub"]}
+
+    def resolve(self, request, claims, get_user, use_cache=True):
+        """Return the user (or None) given a function that looks it up
+
         Args:
           request: the current request
           claims (dict): the verified payload of the ID or Access token
+          get_user (callable): returns the user that matches the lookup, like
+            ``QuerySet.get``
+          use_cache (bool): whether to use the user cache
 
         Returns:
           user or None
         """
         uid = claims["sub"]
-        try:
-            user = UserModel.objects.get(remote__external_user_id=uid)
-        except ObjectDoesNotExist:
-            return
+        user = get_cached_user(uid) if use_cache else None
+        if user is None:
+            try:
+                user = get_user()
+            except ObjectDoesNotExist:
+                return
+            if use_cache:
+                set_cached_user(uid, user)
 
         if not self.user_can_authenticate(user):
             raise PermissionDenied(settings.NENS_AUTH_ERROR_USER_INACTIVE)
 
         return user
 
+    async def aauthenticate(self, request, claims):
+        """Async version of ``authenticate`` (used by Django >= 5.0)
+
+        As ``resolve`` is sync, the user is looked up (in the user cache or the
+        database) first.
+        """
+        uid = claims["sub"]
+        user = await aget_cached_user(uid)
+        if user is None:
+            try:
+                user = await _user_queryset().aget(**self.get_lookup(claims))
+            except ObjectDoesNotExist:
+                return
+            await aset_cached_user(uid, user)
+
+        return self.resolve(request, claims, lambda: user, use_cache=False)
+
 
 def _nens_user_extract_username(claims):
     """Return the username from the email claim if the user is a N&S user.
@@ -88,6 +159,13 @@ class SSOMigrationBackend(ModelBackend):
         Returns:
           user or None
         """
+        lookup = self.get_lookup(claims)
+        if lookup is None:
+            return
+        return self.resolve(request, claims, lambda: _user_queryset().get(**lookup))
+
+    def get_lookup(self, claims):
+        """Return the keyword arguments to look up the user with (or None)"""
         username = None
         if int(claims.get("custom:from_sso", 0)) == 1:
             username = claims.get("cognito:username")
@@ -98,9 +176,18 @@ class SSOMigrationBackend(ModelBackend):
             return
 
         email = claims.get("email")
+        return {
+            "nens_auth_username_lower": _lower(username),
+            "nens_auth_email_lower": _lower(email),
+        }
 
+    def resolve(self, request, claims, get_user):
+        """Return the user (or None) given a function that looks it up
+
+        See ``RemoteUserBackend.resolve``.
+        """
         try:
-            user = UserModel.objects.get(username__iexact=username, email__iexact=email)
+            user = get_user()
         except ObjectDoesNotExist:
             return
         except MultipleObjectsReturned:
@@ -150,6 +237,13 @@ class TrustedProviderMigrationBackend(ModelBackend):
         Returns:
           user or None
         """
+        lookup = self.get_lookup(claims)
+        if lookup is None:
+            return
+        return self.resolve(request, claims, lambda: _user_queryset().get(**lookup))
+
+    def get_lookup(self, claims):
+        """Return the keyword arguments to look up the user with (or None)"""
         provider_name = get_oauth_client().extract_provider_name(claims)
         email = claims.get("email")
         # We need email
@@ -160,9 +254,17 @@ class TrustedProviderMigrationBackend(ModelBackend):
             logger.debug("%s not in special list of trusted providers", provider_name)
             return
 
+        return {"nens_auth_email_lower": _lower(email)}
+
+    def resolve(self, request, claims, get_user):
+        """Return the user (or None) given a function that looks it up
+
+        See ``RemoteUserBackend.resolve``.
+        """
         try:
-            user = UserModel.objects.get(email__iexact=email)
+            user = get_user()
         except ObjectDoesNotExist:
+            provider_name = get_oauth_client().extract_provider_name(claims)
             if found_or_wildcard(
                 provider_name, settings.NENS_AUTH_TRUSTED_PROVIDERS_NEW_USERS
             ):
@@ -201,18 +303,31 @@ class AcceptNensBackend(ModelBackend):
           user or None
 
         """
-        username = _nens_user_extract_username(claims)
-        if username is None:
+        lookup = self.get_lookup(claims)
+        if lookup is None:
             return
+        return self.resolve(request, claims, lambda: _user_queryset().get(**lookup))
 
-        email = claims.get("email")
+    def get_lookup(self, claims):
+        """Return the keyword arguments to look up the user with (or None)"""
+        if _nens_user_extract_username(claims) is None:
+            return
+
+        # For our purposes, just a match on email is enough. Some
+        # usernames have been shortened to fit within 20 characters though
+        # the email has not, so we escape some corner cases this way.
+        return {"nens_auth_email_lower": _lower(claims.get("email"))}
 
+    def resolve(self, request, claims, get_user):
+        """Return the user (or None) given a function that looks it up
+
+        See ``RemoteUserBackend.resolve``.
+        """
         try:
-            # For our purposes, just a match on email is enough. Some
-            # usernames have been shortened to fit within 20 characters though
-            # the email has not, so we escape some corner cases this way.
-            user = UserModel.objects.get(email__iexact=email)
+            user = get_user()
         except ObjectDoesNotExist:
+            username = _nens_user_extract_username(claims)
+            email = claims.get("email")
             user = UserModel.objects.create(
                 username=username.lower(), email=email.lower()
             )
@@ -227,3 +342,82 @@ class AcceptNensBackend(ModelBackend):
         create_remote_user(user, claims)
 
         return user
+
+
+class CombinedBackend(ModelBackend):
+    """Backend that combines a chain of the above backends in one query
+
+    The backends in NENS_AUTH_COMBINED_BACKENDS are tried in order, just like
+    Django tries the backends in AUTHENTICATION_BACKENDS. Instead of one
+    query per backend, the users are looked up for all backends at once,
+    with a single (UNION) query.
+
+    A leading RemoteUserBackend is tried on its own first, so that users that
+    are already associated (the common case) are found with its own (cached)
+    query and the UNION query is only done for new users.
+
+    Use this instead of (not in addition to) the separate backends.
+    """
+
+    def get_backends(self):
+        return [import_string(path)() for path in settings.NENS_AUTH_COMBINED_BACKENDS]
+
+    def authenticate(self, request, claims):
+        """Authenticate through the first backend that returns a user
+
+        Args:
+          request: the current request
+          claims (dict): the verified payload of the ID or Access token
+
+        Returns:
+          user or None
+        """
+        steps = []
+        for backend in self.get_backends():
+            lookup = backend.get_lookup(claims)
+            if lookup is not None:
+                steps.append((backend, lookup))
+        if steps and isinstance(steps[0][0], RemoteUserBackend):
+            backend, lookup = steps.pop(0)
+            user = backend.resolve(
+                request, claims, lambda: _user_queryset().get(**lookup)
+            )
+            if user is not None:
+                return user
+        if not steps:
+            return
+
+        candidates = []  # fetched on first use (a user may be cached)
+
+        def get_user(step):
+            if not candidates:
+                candidates.append(self.get_candidates([x[1] for x in steps]))
+            users = [user for (i, user) in candidates[0] if i == step]
+            if not users:
+                raise UserModel.DoesNotExist()
+            if len(users) > 1:
+                raise UserModel.MultipleObjectsReturned()
+            return users[0]
+
+        for step, (backend, _) in enumerate(steps):
+            user = backend.resolve(request, claims, partial(get_user, step))
+            if user is not None:
+                return user
+
+    def get_candidates(self, lookups):
+        """Return the users that match any of the lookups, in one query
+
+        Returns:
+          list of (index of the lookup, user) tuples. A user that matches
+          multiple lookups is returned multiple times.
+        """
+        querysets = [
+            _user_queryset().filter(**lookup).annotate(nens_auth_step=Value(step))
+            for (step, lookup) in enumerate(lookups)
+        ]
+        candidates = []
+        for user in querysets[0].union(*querysets[1:], all=True):
+            step = user.nens_auth_step
+            del user.nens_auth_step  # the user may end up in the user cache
+            candidates.append((step, user))
+        return candidates
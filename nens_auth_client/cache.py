@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+import hashlib
+import threading
+import time
+
+# Seconds between checks whether another process finished fetching
+LOCK_POLL_INTERVAL = 0.1
+
+
+class ExpiringLRUCache:
+    """A thread-safe, size-bounded in-memory cache with per-entry expiry.
+
+    Entries are evicted when they expire or, if the cache is full, in
+    least-recently-used order.
+
+    Args:
+      maxsize (int): the maximum number of entries. 0 disables the cache.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Return the value for key, or default if absent or expired."""
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                return default
+            if expires_at <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        """Store a value until the (unix) timestamp expires_at."""
+        if self.maxsize <= 0 or expires_at <= time.time():
+            return
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def get_or_fetch_shared(name, fetch, outdated=None, alias=None, timeout=None):
+    """Return the result of ``fetch()``, shared between processes.
+
+    Values are stored in the Django cache configured by the
+    NENS_AUTH_SHARED_CACHE setting (a cache alias); if it is not set, this
+    just calls ``fetch()``. A cached value is used unless it is ``outdated``.
+    Otherwise, one process fetches while holding a lock in the cache, and the
+    others wait (at most NENS_AUTH_TIMEOUT seconds) for its result.
+
+    Args:
+      name (str): identifies the value in the cache
+      fetch (callable): fetches a (picklable) value, e.g. through HTTP
+      outdated: a value that should be fetched anew, if cached. Or a function
+        that takes a cached value and returns whether it is outdated.
+      alias (str): the cache alias to use instead of NENS_AUTH_SHARED_CACHE
+      timeout: the number of seconds to cache a fetched value. Or a function
+        that takes the value and returns that. Default:
+        NENS_AUTH_SHARED_CACHE_TIMEOUT.
+
+    Returns:
+      the cached or fetched value
+    """
+    alias = alias or settings.NENS_AUTH_SHARED_CACHE
+    if not alias:
+        return fetch()
+
+    def is_outdated(value):
+        return outdated(value) if callable(outdated) else value == outdated
+
+    if timeout is None:
+        timeout = settings.NENS_AUTH_SHARED_CACHE_TIMEOUT
+
+    cache = caches[alias]
+    key = "nens_auth_client:" + hashlib.sha256(name.encode()).hexdigest()
+    lock_key = key + ":lock"
+    deadline = time.time() + settings.NENS_AUTH_TIMEOUT
+    while True:
+        value = cache.get(key)
+        if value is not None and not is_outdated(value):
+            return value
+        if cache.add(lock_key, True, timeout=settings.NENS_AUTH_TIMEOUT):
+            try:
+                value = fetch()
+                cache.set(
+                    key, value, timeout=timeout(value) if callable(timeout) else timeout
+                )
+            finally:
+                cache.delete(lock_key)
+            return value
+        if time.time() >= deadline:
+            # The other process is taking too long, fetch without the lock
+            return fetch()
+        time.sleep(LOCK_POLL_INTERVAL)
@@ -1,6 +1,8 @@
 from django.conf import settings
 from django.core.checks import Error
 from django.core.checks import register
+from django.core.exceptions import ImproperlyConfigured
+from nens_auth_client.middleware import compile_excluded_paths
 
 ACCESS_TOKEN_MIDDLWARE = "nens_auth_client.middleware.AccessTokenMiddleware"
 DJANGO_AUTH_MIDDLEWARE = "django.contrib.auth.middleware.AuthenticationMiddleware"
@@ -67,6 +69,18 @@ def check_access_token_middleware_order(app_configs=None, **kwargs):
     return []
 
 
+@register()
+def check_bearer_exclude_url_names(app_configs=None, **kwargs):
+    """Check if NENS_AUTH_BEARER_EXCLUDE_URL_NAMES can be reversed"""
+    if ACCESS_TOKEN_MIDDLWARE not in settings.MIDDLEWARE:
+        return []
+    try:
+        compile_excluded_paths([], settings.NENS_AUTH_BEARER_EXCLUDE_URL_NAMES)
+    except ImproperlyConfigured as e:
+        return [Error(str(e))]
+    return []
+
+
 @register()
 def check_error_message_formatting(app_configs=None, **kwargs):
     """Check ERROR_INVITATION_WRONG_USER and _EMAIL for correct formatting.
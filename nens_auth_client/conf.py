@@ -8,15 +8,42 @@ class NensAuthClientAppConf(AppConf):
     URL_NAMESPACE = "nens_auth_client:"  # prefixed to viewnames in reverse()
     TIMEOUT = 10  # Timeout for token, JWKS and discovery requests (seconds)
     LEEWAY = 120  # Amount of seconds that a token's expiry can be off
+    ACCESS_TOKEN_CACHE_SIZE = 1024  # Max. verified access tokens cached (0 = off)
+    MAX_TOKEN_LENGTH = 8192  # Longer Bearer tokens are rejected without decoding
+    JWKS_MIN_REFRESH_INTERVAL = 60  # Min. seconds between JWKS refreshes (unknown kid)
+    BACKGROUND_REFRESH_INTERVAL = None  # Seconds between JWKS/discovery refreshes
+    SHARED_CACHE = None  # Django cache alias for sharing JWKS/discovery (None = off)
+    SHARED_CACHE_TIMEOUT = 3600  # Seconds to keep JWKS/discovery in the shared cache
+    SNAPSHOT_PATH = None  # JSON file to preload JWKS/discovery from at startup
+    CC_TOKEN_REFRESH_MARGIN = 60  # Seconds before expiry to refresh CC tokens
+    CC_TOKEN_CACHE = None  # Django cache alias for sharing CC tokens (None = off)
+    CC_TOKEN_REUSE_SUPERSET = False  # Use cached CC tokens that have more scopes
+    HTTP_POOL_CONNECTIONS = 10  # Hosts to keep pools for (OAuth2(CC)Session)
+    HTTP_POOL_MAXSIZE = 10  # Connections to keep per host (OAuth2(CC)Session)
+    HTTP_MAX_RETRIES = 0  # Retries (int or urllib3 Retry) for OAuth2(CC)Session
+    HTTP_TIMEOUT = None  # Default timeout (seconds) for OAuth2(CC)Session requests
+    HTTP_TCP_KEEPALIVE = False  # Enable TCP keepalive on pooled connections
 
     DEFAULT_SUCCESS_URL = "/"  # Default redirect after successful login
     DEFAULT_LOGOUT_URL = "/"  # Default redirect after successful logout
 
     RESOURCE_SERVER_ID = None  # For Access Tokens ("aud" should equal this)
+    LAZY_BEARER = False  # Verify Bearer tokens on first access of request.user
+    BEARER_EXCLUDE_PATHS = []  # Path prefixes that skip Bearer authentication
+    BEARER_EXCLUDE_URL_NAMES = []  # URL names that skip Bearer authentication
 
     PERMISSION_BACKEND = "nens_auth_client.permissions.DjangoPermissionBackend"
     OAUTH_BACKEND = "nens_auth_client.cognito.CognitoOAuthClient"
 
+    COMBINED_BACKENDS = [  # The backends that CombinedBackend tries (in order)
+        "nens_auth_client.backends.RemoteUserBackend",
+    ]
+
+    USER_CACHE_TIMEOUT = 0  # Seconds to cache users by "sub" claim (0 = off)
+    USER_CACHE = None  # Django cache alias for the user cache (None = local memory)
+    STORE_TOKENS = True  # Store tokens on the RemoteUser (needed for OAuth2Session)
+    REMOTE_USER_UPDATE_INTERVAL = 0  # Min. seconds between RemoteUser updates
+
     INVITATION_EMAIL_SUBJECT = "Invitation"
     INVITATION_EXPIRY_DAYS = 14  # change this to change the default expiry
     USERNAME_MAX_LENGTH = 50
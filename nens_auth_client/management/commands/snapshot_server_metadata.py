@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from nens_auth_client.oauth import get_oauth_client
+
+import json
+import os
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the authorization server's discovery metadata and JWKS to a "
+        "snapshot file (default: NENS_AUTH_SNAPSHOT_PATH)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default=None)
+
+    def handle(self, *args, **options):
+        path = options["path"] or settings.NENS_AUTH_SNAPSHOT_PATH
+        if not path:
+            raise CommandError(
+                "Provide a path or configure the NENS_AUTH_SNAPSHOT_PATH setting."
+            )
+
+        client = get_oauth_client()
+        client.refresh()
+        snapshot = client.get_snapshot()
+        # Write to a temporary file first, so that the snapshot is replaced
+        # atomically and processes never read a partially written file.
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+        except OSError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            self.style.SUCCESS("Successfully wrote snapshot to {}".format(path))
+        )
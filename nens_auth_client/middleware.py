@@ -1,9 +1,108 @@
 from .oauth import get_oauth_client
+from asgiref.sync import sync_to_async
 from authlib.jose.errors import JoseError
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.urls import get_script_prefix
+from django.urls import NoReverseMatch
+from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
 
 import django.contrib.auth as django_auth
 
+try:
+    from asgiref.sync import iscoroutinefunction
+    from asgiref.sync import markcoroutinefunction
+except ImportError:  # asgiref < 3.6
+    from asyncio import coroutines
+    from asyncio import iscoroutinefunction
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = coroutines._is_coroutine
+        return func
+
+
+def _get_bearer_token(request):
+    # See https://tools.ietf.org/html/rfc6750#section-2.1,
+    # Bearer is case-sensitive and there is exactly 1 separator after.
+    auth_header = request.META.get("HTTP_AUTHORIZATION", "")
+    return auth_header[7:] if auth_header.startswith("Bearer") else None
+
+
+def compile_excluded_paths(prefixes, url_names):
+    """Compile path prefixes and URL names into a function that matches paths.
+
+    URL names are reversed once into exact paths, so they cannot have
+    arguments (use a path prefix for these).
+
+    Args:
+      prefixes (list of str): path prefixes, e.g. "/static/"
+      url_names (list of str): URL names, e.g. "health" or "api:health"
+
+    Returns:
+      a function that takes a path (``request.path_info``) and returns True if
+      it is excluded
+
+    Raises:
+      ImproperlyConfigured: if a URL name cannot be reversed without arguments
+    """
+    script_prefix = get_script_prefix()
+    exact = set()
+    for name in url_names:
+        try:
+            url = reverse(name)
+        except NoReverseMatch:
+            raise ImproperlyConfigured(
+                "Cannot exclude URL name '{}' from Bearer authentication, it "
+                "does not exist or it requires arguments. Use "
+                "NENS_AUTH_BEARER_EXCLUDE_PATHS instead.".format(name)
+            )
+        exact.add("/" + url[len(script_prefix) :])
+    exact = frozenset(exact)
+    prefixes = tuple(prefixes)
+
+    def is_excluded(path):
+        return path in exact or path.startswith(prefixes)
+
+    return is_excluded
+
+
+# Request attribute for sharing the Bearer token verification result
+BEARER_MEMO_ATTR = "_nens_auth_bearer"
+
+
+def get_bearer_memo(request, token):
+    """Return (claims, user) if ``token`` was already processed for this request.
+
+    Claims and/or user are None if the token was invalid or if no user was
+    found. Returns None if the token was not processed yet.
+    """
+    memo = getattr(request, BEARER_MEMO_ATTR, None)
+    if memo is not None and memo[0] == token:
+        return memo[1], memo[2]
+
+
+def set_bearer_memo(request, token, claims, user):
+    """Store the result of processing a Bearer token on the request.
+
+    This prevents double work when both the middleware and the REST framework
+    authentication class are used.
+    """
+    # Store it on the django HttpRequest (also if this is a DRF Request)
+    setattr(
+        getattr(request, "_request", request), BEARER_MEMO_ATTR, (token, claims, user)
+    )
+
+
+def _login(request, user):
+    # Log the user in (without creating a session)
+    request.user = user
+
+    async def auser():
+        return user
+
+    request.auser = auser
+
 
 class AccessTokenMiddleware:
     """Middleware for user authentication with OAuth2 Bearer tokens
@@ -15,39 +114,158 @@ class AccessTokenMiddleware:
 
     Any authorization logic based on the "scope" claim should be implemented
     based on ``request.user.oauth2_scope`` (which is set by this middleware).
+
+    The middleware supports both sync (WSGI) and async (ASGI) request
+    handling. Under ASGI, token verification and the user lookup
+    (``aauthenticate``, Django >= 5.0) do not block the event loop.
+
+    If NENS_AUTH_LAZY_BEARER is True, ``request.user`` becomes a lazy object
+    and the token is only verified when it is accessed (like Django's
+    AuthenticationMiddleware does for session users).
+
+    Requests to paths in NENS_AUTH_BEARER_EXCLUDE_PATHS (prefixes) or
+    NENS_AUTH_BEARER_EXCLUDE_URL_NAMES skip Bearer token processing.
     """
 
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        self._is_excluded = None  # compiled on the first request
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        # See https://tools.ietf.org/html/rfc6750#section-2.1,
-        # Bearer is case-sensitive and there is exactly 1 separator after.
-        auth_header = request.META.get("HTTP_AUTHORIZATION", "")
-        token = auth_header[7:] if auth_header.startswith("Bearer") else None
+        if self.async_mode:
+            return self.__acall__(request)
 
-        # Do something only if there is a Bearer token and there is no user.
-        if not (token and request.user.is_anonymous):
+        token = self._get_token(request)
+        if not token:
             return self.get_response(request)
 
-        client = get_oauth_client()
-        try:
-            claims = client.parse_access_token(token, leeway=settings.NENS_AUTH_LEEWAY)
-        except JoseError:
-            # do nothing: not authenticating will lead to a 401 eventually
+        if settings.NENS_AUTH_LAZY_BEARER:
+            self._login_lazy(request, token)
             return self.get_response(request)
 
-        # The django authentication backend(s) should find a local user
-        user = django_auth.authenticate(request, claims=claims)
-
-        if user is None:
-            # do nothing: not authenticating will lead to a 401 eventually
+        # Do something only if there is no user (e.g. from a session).
+        if not request.user.is_anonymous:
             return self.get_response(request)
 
-        # Log the user in (without creating a session)
-        request.user = user
-
-        # Store the scope on the user object for later usage
-        request.user.oauth2_scope = claims.get("scope")
+        user = self._authenticate(request, token)
+        if user is not None:
+            _login(request, user)
 
+        # Not authenticating (user is None) will lead to a 401 eventually
         return self.get_response(request)
+
+    async def __acall__(self, request):
+        token = self._get_token(request)
+        if not token:
+            return await self.get_response(request)
+
+        if settings.NENS_AUTH_LAZY_BEARER:
+            self._login_lazy(request, token)
+            return await self.get_response(request)
+
+        # Do something only if there is no user (e.g. from a session).
+        if hasattr(request, "auser"):  # Django >= 5.0
+            is_anonymous = (await request.auser()).is_anonymous
+        else:
+            is_anonymous = await sync_to_async(lambda: request.user.is_anonymous)()
+        if not is_anonymous:
+            return await self.get_response(request)
+
+        user = await self._aauthenticate(request, token)
+        if user is not None:
+            _login(request, user)
+
+        # Not authenticating (user is None) will lead to a 401 eventually
+        return await self.get_response(request)
+
+    def _get_token(self, request):
+        """Return the Bearer token, or None if absent or the path is excluded"""
+        token = _get_bearer_token(request)
+        if not token:
+            return
+        if self._is_excluded is None:
+            self._is_excluded = compile_excluded_paths(
+                settings.NENS_AUTH_BEARER_EXCLUDE_PATHS,
+                settings.NENS_AUTH_BEARER_EXCLUDE_URL_NAMES,
+            )
+        if not self._is_excluded(request.path_info):
+            return token
+
+    def _authenticate(self, request, token):
+        """Return the user for a Bearer token, or None"""
+        memo = get_bearer_memo(request, token)
+        if memo is not None:
+            claims, user = memo
+        else:
+            client = get_oauth_client()
+            try:
+                claims = client.parse_access_token(
+                    token, leeway=settings.NENS_AUTH_LEEWAY
+                )
+            except (JoseError, ValueError):
+                set_bearer_memo(request, token, None, None)
+                return
+
+            # The django authentication backend(s) should find a local user
+            user = django_auth.authenticate(request, claims=claims)
+            set_bearer_memo(request, token, claims, user)
+
+        if user is not None:
+            # Store the scope on the user object for later usage
+            user.oauth2_scope = claims.get("scope")
+        return user
+
+    async def _aauthenticate(self, request, token):
+        """Async version of ``_authenticate``"""
+        memo = get_bearer_memo(request, token)
+        if memo is not None:
+            claims, user = memo
+        else:
+            client = get_oauth_client()
+            try:
+                claims = await client.aparse_access_token(
+                    token, leeway=settings.NENS_AUTH_LEEWAY
+                )
+            except (JoseError, ValueError):
+                set_bearer_memo(request, token, None, None)
+                return
+
+            # The django authentication backend(s) should find a local user
+            if hasattr(django_auth, "aauthenticate"):  # Django >= 5.0
+                user = await django_auth.aauthenticate(request, claims=claims)
+            else:
+                user = await sync_to_async(django_auth.authenticate)(
+                    request, claims=claims
+                )
+            set_bearer_memo(request, token, claims, user)
+
+        if user is not None:
+            # Store the scope on the user object for later usage
+            user.oauth2_scope = claims.get("scope")
+        return user
+
+    def _login_lazy(self, request, token):
+        """Set request.user to a lazy object that authenticates on first use"""
+        session_user = request.user  # probably a lazy object as well
+        resolved = []
+
+        def get_user():
+            if not resolved:
+                user = None
+                if session_user.is_anonymous:
+                    user = self._authenticate(request, token)
+                resolved.append(session_user if user is None else user)
+            return resolved[0]
+
+        request.user = SimpleLazyObject(get_user)
+
+        async def auser():
+            return await sync_to_async(get_user)()
+
+        request.auser = auser
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:51
+
+from django.db import migrations
+from django.db import models
+
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("nens_auth_client", "0005_alter_invitation_help_text"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RemoteUserTokens",
+            fields=[
+                (
+                    "remote_user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="tokens",
+                        serialize=False,
+                        to="nens_auth_client.remoteuser",
+                    ),
+                ),
+                (
+                    "id_token",
+                    models.TextField(
+                        blank=True,
+                        help_text="The most recent ID token provided by the external identity provider.",
+                    ),
+                ),
+                (
+                    "access_token",
+                    models.TextField(
+                        blank=True,
+                        help_text="The most recent access token provided by the external identity provider.",
+                    ),
+                ),
+                (
+                    "refresh_token",
+                    models.TextField(
+                        blank=True,
+                        help_text="The most recent refresh token provided by the external identity provider.",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "remote user tokens",
+            },
+        ),
+    ]
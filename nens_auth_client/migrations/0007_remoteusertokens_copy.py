@@ -0,0 +1,48 @@
+from django.db import migrations
+
+TOKEN_FIELDS = ("id_token", "access_token", "refresh_token")
+BATCH_SIZE = 1000
+
+
+def copy_tokens(apps, schema_editor):
+    """Copy the (non-empty) tokens from RemoteUser to RemoteUserTokens"""
+    RemoteUser = apps.get_model("nens_auth_client", "RemoteUser")
+    RemoteUserTokens = apps.get_model("nens_auth_client", "RemoteUserTokens")
+    remote_users = RemoteUser.objects.exclude(
+        id_token="", access_token="", refresh_token=""
+    ).values_list("pk", *TOKEN_FIELDS)
+    batch = []
+    for pk, id_token, access_token, refresh_token in remote_users.iterator():
+        batch.append(
+            RemoteUserTokens(
+                remote_user_id=pk,
+                id_token=id_token,
+                access_token=access_token,
+                refresh_token=refresh_token,
+            )
+        )
+        if len(batch) >= BATCH_SIZE:
+            RemoteUserTokens.objects.bulk_create(batch)
+            batch = []
+    RemoteUserTokens.objects.bulk_create(batch)
+
+
+def copy_tokens_back(apps, schema_editor):
+    """Copy the tokens from RemoteUserTokens back to RemoteUser"""
+    RemoteUser = apps.get_model("nens_auth_client", "RemoteUser")
+    RemoteUserTokens = apps.get_model("nens_auth_client", "RemoteUserTokens")
+    tokens = RemoteUserTokens.objects.values_list("remote_user_id", *TOKEN_FIELDS)
+    for pk, id_token, access_token, refresh_token in tokens.iterator():
+        RemoteUser.objects.filter(pk=pk).update(
+            id_token=id_token, access_token=access_token, refresh_token=refresh_token
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("nens_auth_client", "0006_remoteusertokens"),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_tokens, copy_tokens_back),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:51
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("nens_auth_client", "0007_remoteusertokens_copy"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="remoteuser",
+            name="access_token",
+        ),
+        migrations.RemoveField(
+            model_name="remoteuser",
+            name="id_token",
+        ),
+        migrations.RemoveField(
+            model_name="remoteuser",
+            name="refresh_token",
+        ),
+    ]
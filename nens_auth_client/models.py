@@ -24,8 +24,27 @@ logger = logging.getLogger(__name__)
 user_model = getattr(settings, "AUTH_USER_MODEL", None) or "auth.User"
 
 
+def _token_property(name):
+    """Access a token of a RemoteUser (these are stored in RemoteUserTokens)"""
+
+    def fget(self):
+        return getattr(self._get_tokens(), name)
+
+    def fset(self, value):
+        setattr(self._get_tokens(), name, value)
+        self._tokens_changed = True
+
+    return property(fget, fset)
+
+
 class RemoteUser(models.Model):
-    """Associates an external user with a local user"""
+    """Associates an external user with a local user
+
+    The tokens are stored in a separate table (``RemoteUserTokens``), so
+    that this table stays narrow. For backwards compatibility, they can be
+    accessed as attributes of the RemoteUser. Tokens that are changed
+    through these attributes are saved together with the RemoteUser.
+    """
 
     user = models.ForeignKey(
         user_model, related_name="remote", on_delete=models.CASCADE
@@ -41,6 +60,38 @@ class RemoteUser(models.Model):
         auto_now=True,
         help_text="The last time this remote user logged in.",
     )
+
+    id_token = _token_property("id_token")
+    access_token = _token_property("access_token")
+    refresh_token = _token_property("refresh_token")
+
+    def __str__(self):
+        return self.external_user_id
+
+    def _get_tokens(self):
+        try:
+            return self.tokens
+        except RemoteUserTokens.DoesNotExist:
+            self.tokens = RemoteUserTokens(remote_user=self)
+            return self.tokens
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if getattr(self, "_tokens_changed", False):
+            self.tokens.remote_user = self  # sets the id if self was new
+            self.tokens.save()
+            self._tokens_changed = False
+
+
+class RemoteUserTokens(models.Model):
+    """The most recent tokens of a RemoteUser"""
+
+    remote_user = models.OneToOneField(
+        RemoteUser,
+        primary_key=True,
+        related_name="tokens",
+        on_delete=models.CASCADE,
+    )
     id_token = models.TextField(
         blank=True,
         help_text="The most recent ID token provided by the external identity provider.",
@@ -54,8 +105,11 @@ class RemoteUser(models.Model):
         help_text="The most recent refresh token provided by the external identity provider.",
     )
 
+    class Meta:
+        verbose_name_plural = "remote user tokens"
+
     def __str__(self):
-        return self.external_user_id
+        return str(self.remote_user_id)
 
 
 def _validate_permissions(value):
@@ -3,11 +3,24 @@ from authlib.oidc.discovery import get_well_known_url
 from django.conf import settings
 from django.utils.module_loading import import_string
 
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
 # Create the global OAuth registry
 oauth_registry = OAuth()
 
 
 def get_oauth_client():
+    if settings.NENS_AUTH_BACKGROUND_REFRESH_INTERVAL:
+        # Started here and not when Django starts, so that it runs in the
+        # process that serves requests (also after forking workers).
+        from .refresher import start_refresher
+
+        start_refresher(settings.NENS_AUTH_BACKGROUND_REFRESH_INTERVAL)
+
     client = oauth_registry.create_client("oauth")
     if client is not None:
         return client
@@ -21,4 +34,49 @@ def get_oauth_client():
         client_kwargs={"scope": " ".join(settings.NENS_AUTH_SCOPE)},
         client_cls=import_string(settings.NENS_AUTH_OAUTH_BACKEND),
     )
-    return oauth_registry.create_client("oauth")
+    client = oauth_registry.create_client("oauth")
+    if settings.NENS_AUTH_SNAPSHOT_PATH:
+        preload_snapshot(client, settings.NENS_AUTH_SNAPSHOT_PATH)
+    return client
+
+
+def _revalidate(client):
+    try:
+        client.refresh()
+    except Exception:
+        logger.exception("Could not revalidate the OAuth2 server metadata snapshot")
+
+
+def preload_snapshot(client, path):
+    """Load server metadata and JWKS from a snapshot file into the client.
+
+    After loading, the metadata and JWKS are fetched anew in a background
+    thread. If that fails (e.g. the authorization server is down), the client
+    keeps using the snapshot.
+
+    Snapshot files are created with the ``snapshot_server_metadata``
+    management command.
+
+    Returns:
+      whether the snapshot was loaded
+    """
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        logger.warning("Could not read server metadata snapshot %s", path)
+        return False
+
+    if not client.load_snapshot(snapshot):
+        logger.warning(
+            "Server metadata snapshot %s is invalid or for another server", path
+        )
+        return False
+
+    threading.Thread(
+        target=_revalidate,
+        args=(client,),
+        name="nens-auth-client-revalidate",
+        daemon=True,
+    ).start()
+    return True
@@ -1,10 +1,63 @@
+from .cache import ExpiringLRUCache
+from .cache import get_or_fetch_shared
+from asgiref.sync import sync_to_async
+from authlib.common.encoding import to_bytes
 from authlib.integrations.django_client import DjangoOAuth2App
 from authlib.jose import JsonWebKey
 from authlib.jose import JsonWebToken
+from authlib.jose.errors import DecodeError
+from authlib.jose.errors import JoseError
+from authlib.jose.util import extract_header
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+import copy
+import hashlib
+import threading
+import time
+
+# Max. amount of unknown key ids to remember
+UNKNOWN_KID_CACHE_SIZE = 1024
+
+
+def _cache_key(token, leeway):
+    """Return the access token cache key for a token"""
+    return hashlib.sha256(to_bytes(token)).digest(), leeway
+
+
+# Incremented on NENS_AUTH_* setting changes (tests), see get_token_decoder
+_settings_version = 0
+
+
+@receiver(setting_changed)
+def _increment_settings_version(setting, **kwargs):
+    global _settings_version
+
+    if setting.startswith("NENS_AUTH_"):
+        _settings_version += 1
 
 
 class BaseOAuthClient(DjangoOAuth2App):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Verified access token claims, keyed by a hash of the raw token
+        self.access_token_cache = ExpiringLRUCache(
+            settings.NENS_AUTH_ACCESS_TOKEN_CACHE_SIZE
+        )
+        # The imported JWK set as (raw jwk set, {kid: key})
+        self._jwk_index = (None, {})
+        # State for refreshing the JWK set when an unknown kid is encountered
+        self._jwk_set_refresh_lock = threading.Lock()
+        self._jwk_set_refreshed_at = 0.0
+        self._unknown_kids = ExpiringLRUCache(UNKNOWN_KID_CACHE_SIZE)
+        # The most recently fetched server metadata (without JWKS)
+        self._fetched_server_metadata = None
+        self._server_metadata_version = 0
+        # The access token decoder as
+        # (version, JsonWebToken, claims_options, allowed algorithms)
+        self._token_decoder = None
+
     def logout_redirect(self, request, redirect_uri=None, login_after=False):
         """Create a redirect to the remote server's logout endpoint
 
@@ -21,19 +74,191 @@ class BaseOAuthClient(DjangoOAuth2App):
         """
         raise NotImplementedError()
 
+    def fetch_server_metadata(self):
+        """Fetch the server metadata (OpenID discovery document)."""
+        with self.client_cls(**self.client_kwargs) as session:
+            resp = session.request(
+                "GET", self._server_metadata_url, withhold_token=True
+            )
+            resp.raise_for_status()
+            return resp.json()
+
+    def _get_or_fetch_shared(self, name, fetch, force=False):
+        """Fetch a value through the shared cache (see ``get_or_fetch_shared``).
+
+        Values are shared together with the time they were fetched. A forced
+        fetch reuses a value that was fetched (by any process) less than
+        NENS_AUTH_JWKS_MIN_REFRESH_INTERVAL seconds ago, so that processes that
+        refresh at the same time do not all fetch.
+        """
+        interval = settings.NENS_AUTH_JWKS_MIN_REFRESH_INTERVAL
+        fetched_at, value = get_or_fetch_shared(
+            name,
+            lambda: (time.time(), fetch()),
+            outdated=(
+                (lambda cached: time.time() - cached[0] >= interval) if force else None
+            ),
+        )
+        return value
+
+    def load_server_metadata(self, force=False):
+        """Load the server metadata (OpenID discovery), optionally forcing a fetch.
+
+        If NENS_AUTH_SHARED_CACHE is set, the metadata is shared with other
+        processes through that Django cache.
+
+        Args:
+          force (bool): whether to fetch the metadata even if already loaded
+        """
+        if self._server_metadata_url and (
+            force or "_loaded_at" not in self.server_metadata
+        ):
+            metadata = self._get_or_fetch_shared(
+                "metadata:" + self._server_metadata_url,
+                self.fetch_server_metadata,
+                force=force,
+            )
+            if metadata != self._fetched_server_metadata:
+                self._server_metadata_version += 1
+            self._fetched_server_metadata = metadata
+            self.server_metadata.update(metadata, _loaded_at=time.time())
+        return self.server_metadata
+
+    def fetch_jwk_set(self, force=False):
+        """Load the JWK set, optionally forcing a fetch.
+
+        If NENS_AUTH_SHARED_CACHE is set, the JWK set is shared with other
+        processes through that Django cache.
+
+        Args:
+          force (bool): whether to fetch the JWK set even if already loaded
+        """
+        jwk_set = self.load_server_metadata().get("jwks")
+        if jwk_set and not force:
+            return jwk_set
+
+        jwk_set = self._get_or_fetch_shared(
+            "jwks:" + str(self._server_metadata_url),
+            lambda: super(BaseOAuthClient, self).fetch_jwk_set(force=True),
+            force=force,
+        )
+        self.server_metadata["jwks"] = jwk_set
+        return jwk_set
+
+    def get_snapshot(self):
+        """Return the server metadata and JWK set as a JSON-serializable dict.
+
+        See ``load_snapshot``.
+        """
+        metadata = {
+            k: v
+            for (k, v) in self.load_server_metadata().items()
+            if k not in ("jwks", "_loaded_at")
+        }
+        return {
+            "server_metadata_url": self._server_metadata_url,
+            "metadata": metadata,
+            "jwks": self.fetch_jwk_set(),
+        }
+
+    def load_snapshot(self, snapshot):
+        """Load the server metadata and JWK set from a snapshot.
+
+        The snapshot is ignored if it is invalid or if it was made for a
+        different authorization server (server metadata URL).
+
+        Args:
+          snapshot (dict): as returned by ``get_snapshot``
+
+        Returns:
+          whether the snapshot was loaded
+        """
+        if (
+            not isinstance(snapshot, dict)
+            or snapshot.get("server_metadata_url") != self._server_metadata_url
+            or not isinstance(snapshot.get("metadata"), dict)
+            or not isinstance(snapshot.get("jwks"), dict)
+        ):
+            return False
+        try:
+            self.get_key_index(snapshot["jwks"])
+        except (KeyError, TypeError, ValueError):
+            return False
+        if snapshot["metadata"] != self._fetched_server_metadata:
+            self._server_metadata_version += 1
+        self._fetched_server_metadata = snapshot["metadata"]
+        self.server_metadata.update(
+            snapshot["metadata"], jwks=snapshot["jwks"], _loaded_at=time.time()
+        )
+        return True
+
+    def refresh(self):
+        """Fetch the server metadata and JWK set, and rebuild the key index."""
+        self.load_server_metadata(force=True)
+        self.get_key_index(self.fetch_jwk_set(force=True))
+
+    def get_key_index(self, jwk_set):
+        """Return the JWK set as a ``{kid: key}`` dict.
+
+        Importing keys is relatively expensive, so the index is kept and only
+        rebuilt if the (raw) JWK set differs from the one it was built from.
+        """
+        raw, index = self._jwk_index
+        if jwk_set != raw:
+            index = {}
+            for key in JsonWebKey.import_key_set(jwk_set).keys:
+                index.setdefault(key.kid, key)
+            # Assign raw and index in one go, for thread-safety
+            self._jwk_index = (jwk_set, index)
+        return index
+
+    def refresh_key_index(self, kid):
+        """Refresh the JWK set because it does not contain ``kid``.
+
+        Concurrent refreshes are merged into one: threads wait for a running
+        refresh and then use its result. Forced refreshes happen at most once
+        every NENS_AUTH_JWKS_MIN_REFRESH_INTERVAL seconds, and key ids that
+        are still unknown after a refresh are remembered for that same period,
+        so that tokens with bogus key ids are rejected without network I/O.
+
+        Returns:
+          the (possibly refreshed) JWK set as a ``{kid: key}`` dict
+        """
+        if self._unknown_kids.get(kid):
+            return self._jwk_index[1]
+
+        interval = settings.NENS_AUTH_JWKS_MIN_REFRESH_INTERVAL
+        with self._jwk_set_refresh_lock:
+            # Another thread may have refreshed while we were waiting
+            index = self.get_key_index(self.fetch_jwk_set())
+            if kid in index:
+                return index
+            now = time.time()
+            if now - self._jwk_set_refreshed_at >= interval:
+                # Set this before fetching, so that failing requests are also
+                # rate limited.
+                self._jwk_set_refreshed_at = now
+                index = self.get_key_index(self.fetch_jwk_set(force=True))
+            if kid not in index:
+                self._unknown_kids.set(kid, True, now + interval)
+        return index
+
     def load_key(self, header, payload):
         """Load a JSONWebKey from the authorization server given JWT header and payload.
 
         Source:
           authlib.integrations.base_client.sync_openid.parse_id_token
         """
-        jwk_set = JsonWebKey.import_key_set(self.fetch_jwk_set())
-        try:
-            return jwk_set.find_by_kid(header.get("kid"))
-        except ValueError:
+        kid = header.get("kid")
+        if kid is not None and not isinstance(kid, str):
+            raise ValueError("Invalid key id")
+        key = self.get_key_index(self.fetch_jwk_set()).get(kid)
+        if key is None:
             # re-try with new jwk set
-            jwk_set = JsonWebKey.import_key_set(self.fetch_jwk_set(force=True))
-            return jwk_set.find_by_kid(header.get("kid"))
+            key = self.refresh_key_index(kid).get(kid)
+        if key is None:
+            raise ValueError("Invalid JSON Web Key Set")
+        return key
 
     def preprocess_access_token(self, claims):
         """Convert access token claims to standard form, inplace.
@@ -42,40 +267,202 @@ class BaseOAuthClient(DjangoOAuth2App):
           claims (dict): payload of the Access Token
         """
 
-    def parse_access_token(self, token, claims_options=None, leeway=120):
-        """Decode and validate an access token and return its payload.
+    def get_token_decoder(self):
+        """Return the JsonWebToken and claims options for access tokens.
 
-        Args:
-          token (str): access token (base64 encoded JWT)
+        These are built once and then reused; they are rebuilt if the server
+        metadata or the NENS_AUTH_* settings change. In that case, the cache
+        with verified access tokens is cleared as well.
 
         Returns:
-          claims (dict): the token payload
-
-        Raises:
-          authlib.jose.errors.JoseError: if token is invalid
-          ValueError: if the key id is not present in the jwks.json
+          tuple of (JsonWebToken, claims_options)
         """
+        decoder = self._token_decoder
+        if self._is_token_decoder_current(decoder):
+            return decoder[1], decoder[2]
+
         metadata = self.load_server_metadata()
         claims_options = {
             "aud": {"essential": True, "value": settings.NENS_AUTH_RESOURCE_SERVER_ID},
             "iss": {"essential": True, "value": metadata["issuer"]},
             "sub": {"essential": True},
             "scope": {"essential": True},
-            **(claims_options or {}),
         }
 
         alg_values = metadata.get("id_token_signing_alg_values_supported")
         if not alg_values:
             alg_values = ["RS256"]
 
-        claims = JsonWebToken(alg_values).decode(
-            token, key=self.load_key, claims_options=claims_options
+        version = (self._server_metadata_version, _settings_version)
+        self._token_decoder = (
+            version,
+            JsonWebToken(alg_values),
+            claims_options,
+            frozenset(alg_values),
         )
+        self.access_token_cache.clear()
+        return self._token_decoder[1], self._token_decoder[2]
+
+    def _is_token_decoder_current(self, decoder):
+        return decoder is not None and decoder[0] == (
+            self._server_metadata_version,
+            _settings_version,
+        )
+
+    def parse_access_token(self, token, claims_options=None, leeway=120):
+        """Decode and validate an access token and return its payload.
+
+        Verified claims are cached (keyed by a hash of the token) until the
+        token's "exp" claim, so that repeated use of the same token skips the
+        signature check. Set NENS_AUTH_ACCESS_TOKEN_CACHE_SIZE to 0 to disable.
+        Tokens parsed with custom ``claims_options`` are never cached.
+
+        Before any cryptography, the token structure is checked with
+        ``check_access_token``.
+
+        Args:
+          token (str): access token (base64 encoded JWT)
+
+        Returns:
+          claims (dict): the token payload
+
+        Raises:
+          authlib.jose.errors.JoseError: if token is invalid
+          ValueError: if the key id is not present in the jwks.json
+        """
+        return self._decode_access_token(token, claims_options, leeway, self.load_key)
+
+    async def aparse_access_token(self, token, claims_options=None, leeway=120):
+        """Async version of ``parse_access_token``.
+
+        Cached tokens are returned directly. Otherwise, the token is verified
+        in a worker thread, as this may involve requests to the authorization
+        server (discovery, JWKS). This includes (re)building the token decoder,
+        so the cache is only consulted here if the decoder is up to date.
+        """
+        if claims_options is None and self._is_token_decoder_current(
+            self._token_decoder
+        ):
+            claims = self.access_token_cache.get(_cache_key(token, leeway))
+            if claims is not None:
+                return copy.copy(claims)
+        return await sync_to_async(self.parse_access_token, thread_sensitive=False)(
+            token, claims_options=claims_options, leeway=leeway
+        )
+
+    def parse_access_tokens(self, tokens, leeway=120):
+        """Decode and validate multiple access tokens.
+
+        Identical tokens are decoded once and the key for each key id ("kid")
+        is looked up once, after which the tokens are verified with that key.
+
+        Args:
+          tokens (iterable of str): access tokens (base64 encoded JWTs)
+
+        Returns:
+          dict of token -> claims (dict) or the error (JoseError or ValueError)
+        """
+        self.get_token_decoder()  # make sure the cache is up to date
+        tokens = list(dict.fromkeys(tokens))
+        results = {}
+        tokens_by_kid = {}
+        for token in tokens:
+            claims = self.access_token_cache.get(_cache_key(token, leeway))
+            if claims is not None:
+                results[token] = copy.copy(claims)
+                continue
+            try:
+                header = self.check_access_token(token)
+            except (JoseError, ValueError) as e:
+                results[token] = e
+                continue
+            tokens_by_kid.setdefault(header.get("kid"), []).append(token)
+
+        for kid, kid_tokens in tokens_by_kid.items():
+            try:
+                key = self.load_key({"kid": kid}, None)
+            except ValueError as e:
+                results.update((token, e) for token in kid_tokens)
+                continue
+            for token in kid_tokens:
+                try:
+                    results[token] = self._decode_access_token(
+                        token, None, leeway, lambda header, payload: key, check=False
+                    )
+                except (JoseError, ValueError) as e:
+                    results[token] = e
+
+        return {token: results[token] for token in tokens}
+
+    def check_access_token(self, token):
+        """Cheaply check the structure of an access token, before verifying it.
+
+        This rejects tokens that are too long (NENS_AUTH_MAX_TOKEN_LENGTH), do
+        not consist of three segments, have a header "alg" that is not
+        allowed, or have a key id ("kid") that is unknown and for which the
+        JWK set cannot be refreshed at this moment (see ``refresh_key_index``).
+        No signature checks or network requests are done.
+
+        Args:
+          token (str): access token (base64 encoded JWT)
+
+        Returns:
+          the (unverified) token header (dict)
+
+        Raises:
+          authlib.jose.errors.DecodeError: if the token is malformed
+          ValueError: if the key id is not present in the jwks.json
+        """
+        if len(token) > settings.NENS_AUTH_MAX_TOKEN_LENGTH:
+            raise DecodeError("Token too long")
+        segments = to_bytes(token).split(b".")
+        if len(segments) != 3 or not all(segments):
+            raise DecodeError("Token should have 3 segments")
+        header = extract_header(segments[0], DecodeError)
+        self.get_token_decoder()
+        alg = header.get("alg")
+        if not isinstance(alg, str) or alg not in self._token_decoder[3]:
+            raise DecodeError("Token 'alg' is not allowed")
+        kid = header.get("kid")
+        if kid is not None and not isinstance(kid, str):
+            raise ValueError("Invalid key id")
+        if kid not in self._jwk_index[1] and (
+            self._unknown_kids.get(kid)
+            or time.time() - self._jwk_set_refreshed_at
+            < settings.NENS_AUTH_JWKS_MIN_REFRESH_INTERVAL
+        ):
+            raise ValueError("Invalid JSON Web Key Set")
+        return header
+
+    def _decode_access_token(self, token, claims_options, leeway, load_key, check=True):
+        jwt, default_claims_options = self.get_token_decoder()
+
+        if len(token) > settings.NENS_AUTH_MAX_TOKEN_LENGTH:
+            raise DecodeError("Token too long")  # before hashing it
+
+        cache_key = None
+        if claims_options is None:
+            cache_key = _cache_key(token, leeway)
+            claims = self.access_token_cache.get(cache_key)
+            if claims is not None:
+                return copy.copy(claims)
+            claims_options = default_claims_options
+        else:
+            claims_options = {**default_claims_options, **claims_options}
+
+        if check:
+            self.check_access_token(token)
+
+        claims = jwt.decode(token, key=load_key, claims_options=claims_options)
 
         # Preprocess the token (to add the "aud" claim)
         self.preprocess_access_token(claims)
 
         claims.validate(leeway=leeway)
+
+        # Tokens without expiry are not cached: they would never be evicted
+        if cache_key is not None and "exp" in claims:
+            self.access_token_cache.set(cache_key, copy.copy(claims), claims["exp"])
         return claims
 
     @staticmethod
@@ -0,0 +1,80 @@
+from .oauth import get_oauth_client
+
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# The running refresher as (process id, Refresher)
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+class Refresher(threading.Thread):
+    """Daemon thread that periodically refreshes the OAuth2 server metadata
+
+    The discovery metadata and the JWK set are fetched directly on start and
+    then every ``interval`` seconds. Errors are logged; the previously
+    fetched metadata and keys remain in use.
+
+    Args:
+      interval (float): seconds between refreshes
+    """
+
+    def __init__(self, interval):
+        super().__init__(name="nens-auth-client-refresher", daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                get_oauth_client().refresh()
+            except Exception:
+                logger.exception("Could not refresh the OAuth2 server metadata")
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def _is_running(refresher):
+    return (
+        refresher is not None
+        and refresher[0] == os.getpid()
+        and refresher[1].is_alive()
+    )
+
+
+def start_refresher(interval):
+    """Start the (process-wide) background refresher, if not already running.
+
+    This is called by ``get_oauth_client``. Threads do not survive a fork, so
+    a new refresher is started if the process id changed.
+
+    Returns:
+      the Refresher thread
+    """
+    global _refresher
+
+    refresher = _refresher
+    if _is_running(refresher):
+        return refresher[1]
+
+    with _refresher_lock:
+        if not _is_running(_refresher):
+            thread = Refresher(interval)
+            thread.start()
+            _refresher = (os.getpid(), thread)
+        return _refresher[1]
+
+
+def stop_refresher():
+    """Stop the background refresher, if it is running."""
+    global _refresher
+
+    with _refresher_lock:
+        if _refresher is not None:
+            _refresher[1].stop()
+            _refresher = None
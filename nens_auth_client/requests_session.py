@@ -1,10 +1,94 @@
+from .cache import get_or_fetch_shared
 from .models import RemoteUser
 from .oauth import get_oauth_client
+from authlib.common.encoding import json_loads
+from authlib.common.encoding import to_bytes
+from authlib.common.encoding import urlsafe_b64decode
 from django.conf import settings
 from requests import Session
+from requests.adapters import HTTPAdapter
 from typing import List
 from typing import Optional
 from typing import Union
+from urllib3.connection import HTTPConnection
+
+import socket
+import threading
+import time
+
+
+class SharedHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter that is shared between sessions
+
+    Closing a session does not close the connections of this adapter, as
+    other sessions may still use them. Requests without a timeout get
+    ``default_timeout``.
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + ["default_timeout", "tcp_keepalive"]
+
+    def __init__(self, default_timeout=None, tcp_keepalive=False, **kwargs):
+        self.default_timeout = default_timeout
+        self.tcp_keepalive = tcp_keepalive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.tcp_keepalive:
+            kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.default_timeout
+        return super().send(request, timeout=timeout, **kwargs)
+
+    def close(self):
+        pass
+
+
+# The shared adapter and the settings it was created with
+_http_adapter = (None, None)
+_http_adapter_lock = threading.Lock()
+
+
+def get_http_adapter() -> SharedHTTPAdapter:
+    """Return the HTTPAdapter (connection pool) shared by all sessions
+
+    It is configured with the NENS_AUTH_HTTP_* settings.
+    """
+    global _http_adapter
+
+    config = (
+        settings.NENS_AUTH_HTTP_POOL_CONNECTIONS,
+        settings.NENS_AUTH_HTTP_POOL_MAXSIZE,
+        settings.NENS_AUTH_HTTP_MAX_RETRIES,
+        settings.NENS_AUTH_HTTP_TIMEOUT,
+        settings.NENS_AUTH_HTTP_TCP_KEEPALIVE,
+    )
+    with _http_adapter_lock:
+        if _http_adapter[0] != config:
+            old_adapter = _http_adapter[1]
+            pool_connections, pool_maxsize, max_retries, timeout, keepalive = config
+            adapter = SharedHTTPAdapter(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                max_retries=max_retries,
+                default_timeout=timeout,
+                tcp_keepalive=keepalive,
+            )
+            _http_adapter = (config, adapter)
+            if old_adapter is not None:
+                # Release the connections (SharedHTTPAdapter.close does not)
+                HTTPAdapter.close(old_adapter)
+        return _http_adapter[1]
+
+
+def _mount_http_adapter(session: Session):
+    adapter = get_http_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
 
 
 def refresh_token(remote_user: RemoteUser):
@@ -25,6 +109,9 @@ class OAuth2Session(Session):
     Automatically refreshes if the access token is expired; in that case,
     the RemoteUser will be updated with a new id_token and access_token.
 
+    Connections are pooled and shared with the other sessions (see
+    ``get_http_adapter``).
+
     Args:
         remote_user: the RemoteUser to get/set the tokens
         **kwargs: see requests.Session.
@@ -37,6 +124,7 @@ class OAuth2Session(Session):
 
     def __init__(self, remote_user: RemoteUser, **kwargs):
         super().__init__(**kwargs)
+        _mount_http_adapter(self)
 
         self.headers.update({"Authorization": f"Bearer {remote_user.access_token}"})
 
@@ -56,17 +144,154 @@ class OAuth2Session(Session):
         self.hooks["response"].append(update_token_on_request)
 
 
-def fetch_cc_token(scope: str, force: bool = False):
+def _get_expires_at(tokens) -> Optional[float]:
+    """Return when the access token in a token response expires (unix time)
+
+    Uses "expires_at" (set by authlib from "expires_in") or, if absent, the
+    "exp" claim of the access token (without verifying it). Returns None if
+    the expiry is unknown.
+    """
+    if tokens.get("expires_at"):
+        return float(tokens["expires_at"])
+    try:
+        _, payload, _ = tokens["access_token"].split(".")
+        return float(json_loads(urlsafe_b64decode(to_bytes(payload)))["exp"])
+    except (KeyError, TypeError, ValueError):
+        return
+
+
+def _get_refresh_at(cached) -> Optional[float]:
+    """Return when a cached Client Credentials token should be refreshed
+
+    This is NENS_AUTH_CC_TOKEN_REFRESH_MARGIN seconds before it expires, but
+    at most half of the token's lifetime. Otherwise, tokens that live shorter
+    than the margin would be fetched anew for every request.
+    """
+    expires_at = cached["expires_at"]
+    if expires_at is None:
+        return
+    margin = settings.NENS_AUTH_CC_TOKEN_REFRESH_MARGIN
+    if cached.get("fetched_at") is not None:
+        margin = min(margin, (expires_at - cached["fetched_at"]) / 2)
+    return expires_at - margin
+
+
+def _needs_fetch(cached, rejected_token: Optional[str] = None) -> bool:
+    """Return whether a cached Client Credentials token should be replaced"""
+    if cached is None or cached["access_token"] == rejected_token:
+        return True
+    refresh_at = _get_refresh_at(cached)
+    return refresh_at is not None and refresh_at <= time.time()
+
+
+def normalize_scope(scope: str) -> str:
+    """Return a scope (space-separated) with sorted, unique scope tokens"""
+    return " ".join(sorted(set(scope.split())))
+
+
+def _find_superset(cc_token_cache, scope: str, rejected_token: Optional[str]):
+    """Return a cached token that was granted (at least) the requested scope"""
+    requested = set(scope.split())
+    if not requested:
+        return
+    for cached in list(cc_token_cache.values()):
+        if requested <= set(cached.get("scope", "").split()) and not _needs_fetch(
+            cached, rejected_token
+        ):
+            return cached
+
+
+def _get_shared_timeout(cached) -> float:
+    """Return how long to keep a Client Credentials token in the shared cache"""
+    refresh_at = _get_refresh_at(cached)
+    if refresh_at is None:
+        return settings.NENS_AUTH_SHARED_CACHE_TIMEOUT
+    return max(refresh_at - time.time(), 0)
+
+
+# Guards the creation of the per-scope locks
+_cc_token_locks_lock = threading.Lock()
+
+
+def _get_cc_token_lock(client, scope: str):
+    with _cc_token_locks_lock:
+        if not hasattr(client, "cc_token_locks"):
+            client.cc_token_locks = {}
+        return client.cc_token_locks.setdefault(scope, threading.Lock())
+
+
+def fetch_cc_token(
+    scope: str, force: bool = False, rejected_token: Optional[str] = None
+):
+    """Return a (cached) access token using the Client Credentials Grant
+
+    The token is refreshed NENS_AUTH_CC_TOKEN_REFRESH_MARGIN seconds (at most
+    half its lifetime) before it expires, if it equals ``rejected_token``, or if ``force`` is True.
+
+    Tokens are cached by scope, regardless of the order of the scope tokens.
+    If NENS_AUTH_CC_TOKEN_REUSE_SUPERSET is True, a cached token that was
+    granted more scopes than requested is used as well.
+
+    This is thread-safe: for each scope, only one thread fetches a token at a
+    time. Threads that wait for it use the token it fetched.
+
+    If NENS_AUTH_CC_TOKEN_CACHE is set (a Django cache alias), tokens are
+    also shared between processes through that cache.
+
+    Args:
+        scope: the scope of the token (space-separated)
+        force: fetch a new token, also if it is cached
+        rejected_token: a token that was rejected (e.g. a 401 response)
+
+    Returns:
+        the access token (str)
+    """
     client = get_oauth_client()
     if not hasattr(client, "cc_token_cache"):
         client.cc_token_cache = {}
 
-    if force or (scope not in client.cc_token_cache):
-        # Fetch the token
-        tokens = client.fetch_access_token(grant_type="client_credentials", scope=scope)
-        client.cc_token_cache[scope] = tokens["access_token"]
+    scope = normalize_scope(scope)
+    cached = client.cc_token_cache.get(scope)
+    if not force and not _needs_fetch(cached, rejected_token):
+        return cached["access_token"]
+    if not force and settings.NENS_AUTH_CC_TOKEN_REUSE_SUPERSET:
+        superset = _find_superset(client.cc_token_cache, scope, rejected_token)
+        if superset is not None:
+            return superset["access_token"]
+
+    with _get_cc_token_lock(client, scope):
+        # Another thread may have fetched a new token while we waited
+        current = client.cc_token_cache.get(scope)
+        if current is not cached and not _needs_fetch(current, rejected_token):
+            return current["access_token"]
+
+        def fetch():
+            fetched_at = time.time()
+            tokens = client.fetch_access_token(
+                grant_type="client_credentials", scope=scope
+            )
+            return {
+                "access_token": tokens["access_token"],
+                "expires_at": _get_expires_at(tokens),
+                "fetched_at": fetched_at,
+                # The granted scope, which may differ from the requested one
+                "scope": normalize_scope(tokens.get("scope") or scope),
+            }
+
+        if settings.NENS_AUTH_CC_TOKEN_CACHE:
+            # Share the token with other processes
+            cached = get_or_fetch_shared(
+                "cc_token:{}:{}".format(settings.NENS_AUTH_CLIENT_ID, scope),
+                fetch,
+                outdated=lambda value: force or _needs_fetch(value, rejected_token),
+                alias=settings.NENS_AUTH_CC_TOKEN_CACHE,
+                timeout=_get_shared_timeout,
+            )
+        else:
+            cached = fetch()
+        client.cc_token_cache[scope] = cached
 
-    return client.cc_token_cache[scope]
+    return cached["access_token"]
 
 
 class OAuth2CCSession(Session):
@@ -76,7 +301,11 @@ class OAuth2CCSession(Session):
     This is intended for the Client in the OAuth2 Client Credentials Grant.
 
     The token is cached (for each scope separately) on the global oauth2 client
-    object. It is refreshed automatically if the access token is expired.
+    object. It is refreshed automatically before it expires (checked before
+    every request) and if the Resource Server responds with 401.
+
+    Connections are pooled and shared with the other sessions (see
+    ``get_http_adapter``).
 
     Args:
         scope: a list of scopes for the token. Defaults to settings.NENS_AUTH_SCOPE.
@@ -90,6 +319,7 @@ class OAuth2CCSession(Session):
 
     def __init__(self, scope: Optional[Union[str, List[str]]] = None, **kwargs):
         super().__init__(**kwargs)
+        _mount_http_adapter(self)
 
         if scope is None:
             scope = settings.NENS_AUTH_SCOPE
@@ -98,13 +328,15 @@ class OAuth2CCSession(Session):
         if not isinstance(scope, str):
             scope = " ".join(scope)
 
+        self.scope = scope
         token = fetch_cc_token(scope=scope)
         self.headers.update({"Authorization": f"Bearer {token}"})
 
         def update_token_on_request(r, *args, **kwargs):
             if r.status_code == 401 and not getattr(r.request, "refresh_done", False):
                 # Refresh the token
-                token = fetch_cc_token(scope=scope, force=True)
+                rejected_token = r.request.headers["Authorization"][len("Bearer ") :]
+                token = fetch_cc_token(scope=scope, rejected_token=rejected_token)
                 self.headers.update({"Authorization": f"Bearer {token}"})
 
                 # Resend the request
@@ -113,3 +345,9 @@ class OAuth2CCSession(Session):
                 return self.send(r.request, verify=False)
 
         self.hooks["response"].append(update_token_on_request)
+
+    def request(self, *args, **kwargs):
+        # Never send a token that is known to be expired
+        token = fetch_cc_token(scope=self.scope)
+        self.headers.update({"Authorization": f"Bearer {token}"})
+        return super().request(*args, **kwargs)
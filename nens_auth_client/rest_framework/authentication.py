@@ -1,5 +1,7 @@
 from authlib.jose.errors import JoseError
 from django.conf import settings
+from nens_auth_client.middleware import get_bearer_memo
+from nens_auth_client.middleware import set_bearer_memo
 from nens_auth_client.oauth import get_oauth_client
 from rest_framework import exceptions
 from rest_framework import HTTP_HEADER_ENCODING
@@ -63,17 +65,31 @@ class OAuth2TokenAuthentication:
         return self.authenticate_credentials(request, token)
 
     def authenticate_credentials(self, request, token):
+        # Reuse the result of the AccessTokenMiddleware, if available
+        memo = get_bearer_memo(request, token)
+        if memo is None:
+            claims, user = self._authenticate_credentials(request, token)
+        else:
+            claims, user = memo
+
+        if claims is None:
+            raise exceptions.AuthenticationFailed("Invalid Bearer token.")
+
+        if user is None:
+            raise exceptions.AuthenticationFailed("User not found.")
+
+        return (user, OAuth2Token(claims))
+
+    def _authenticate_credentials(self, request, token):
         # Same logic as in middleware
         client = get_oauth_client()
         try:
             claims = client.parse_access_token(token, leeway=settings.NENS_AUTH_LEEWAY)
-        except JoseError:
-            raise exceptions.AuthenticationFailed("Invalid Bearer token.")
+        except (JoseError, ValueError):
+            set_bearer_memo(request, token, None, None)
+            return None, None
 
         # The django authentication backend(s) should find a local user
         user = django_auth.authenticate(request, claims=claims)
-
-        if user is None:
-            raise exceptions.AuthenticationFailed("User not found.")
-
-        return (user, OAuth2Token(claims))
+        set_bearer_memo(request, token, claims, user)
+        return claims, user
@@ -1,4 +1,6 @@
+from asgiref.sync import async_to_sync
 from django.contrib.auth.models import User
+from django.core.exceptions import FieldError
 from django.core.exceptions import MultipleObjectsReturned
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.exceptions import PermissionDenied
@@ -8,17 +10,19 @@ import pytest
 
 
 @pytest.fixture
-def user_getter(mocker):
-    UserModel = mocker.patch("nens_auth_client.backends.UserModel")
-    return UserModel.objects.get
+def user_queryset(mocker):
+    return mocker.patch("nens_auth_client.backends._user_queryset").return_value
+
+
+@pytest.fixture
+def user_getter(user_queryset):
+    return user_queryset.get
 
 
 @pytest.fixture
-def user_getter_and_creater(mocker):
-    # Using two separate fixtures for getter and creater doesn't work as we
-    # work on the same ".objects".
+def user_getter_and_creater(mocker, user_getter):
     UserModel = mocker.patch("nens_auth_client.backends.UserModel")
-    return UserModel.objects.get, UserModel.objects.create
+    return user_getter, UserModel.objects.create
 
 
 @pytest.fixture
@@ -61,6 +65,62 @@ def test_remote_user_inactive(user_getter):
     user_getter.assert_called_with(remote__external_user_id="remote-uid")
 
 
+def test_remote_user_exists_async(mocker, user_queryset):
+    user_queryset.aget = mocker.AsyncMock(return_value=User(username="testuser"))
+
+    user = async_to_sync(backends.RemoteUserBackend().aauthenticate)(
+        request=None, claims={"sub": "remote-uid"}
+    )
+    assert user.username == "testuser"
+    user_queryset.aget.assert_awaited_with(remote__external_user_id="remote-uid")
+
+
+def test_remote_user_not_exists_async(mocker, user_queryset):
+    user_queryset.aget = mocker.AsyncMock(side_effect=ObjectDoesNotExist)
+
+    user = async_to_sync(backends.RemoteUserBackend().aauthenticate)(
+        request=None, claims={"sub": "remote-uid"}
+    )
+    assert user is None
+
+
+def test_remote_user_inactive_async(mocker, user_queryset):
+    user_queryset.aget = mocker.AsyncMock(
+        return_value=User(username="testuser", is_active=False)
+    )
+
+    with pytest.raises(PermissionDenied):
+        async_to_sync(backends.RemoteUserBackend().aauthenticate)(
+            request=None, claims={"sub": "remote-uid"}
+        )
+
+
+def test_remote_user_cached_async(mocker, user_queryset):
+    mocker.patch(
+        "nens_auth_client.backends.aget_cached_user",
+        new_callable=mocker.AsyncMock,
+        return_value=User(username="testuser"),
+    )
+    get_cached_user = mocker.patch("nens_auth_client.backends.get_cached_user")
+    user_queryset.aget = mocker.AsyncMock()
+
+    user = async_to_sync(backends.RemoteUserBackend().aauthenticate)(
+        request=None, claims={"sub": "remote-uid"}
+    )
+    assert user.username == "testuser"
+    assert not user_queryset.aget.called
+    # the cache is read only once
+    assert not get_cached_user.called
+
+
+def test_no_global_lower_lookup():
+    # The LOWER(...) lookups are aliases, not lookups registered on CharField
+    query = str(backends._user_queryset().filter(nens_auth_email_lower="a").query)
+    assert 'LOWER("auth_user"."email") = a' in query
+    with pytest.raises(FieldError):
+        User.objects.filter(email__lower="a")
+
+
 def test_ssomigration_no_from_sso_claim(user_getter, create_remote_user):
     claims = {"sub": "remote-uid", "cognito:username": "testuser"}
     user_getter.return_value = User(username="testuser")
@@ -95,7 +155,8 @@ def test_ssomigration_exists(user_getter, create_remote_user):
     user = backends.SSOMigrationBackend().authenticate(request=None, claims=claims)
     assert user.username == "testuser"
     user_getter.assert_called_with(
-        username__iexact="testuser", email__iexact="testuser@nelen-schuurmans.nl"
+        nens_auth_username_lower="testuser",
+        nens_auth_email_lower="testuser@nelen-schuurmans.nl",
     )
     create_remote_user.assert_called_with(user, claims)
 
@@ -112,7 +173,8 @@ def test_ssomigration_not_exists(user_getter, create_remote_user):
     user = backends.SSOMigrationBackend().authenticate(request=None, claims=claims)
     assert user is None
     user_getter.assert_called_with(
-        username__iexact="testuser", email__iexact="testuser@nelen-schuurmans.nl"
+        nens_auth_username_lower="testuser",
+        nens_auth_email_lower="testuser@nelen-schuurmans.nl",
     )
     assert not create_remote_user.called
 
@@ -129,7 +191,8 @@ def test_ssomigration_multiple_exist(user_getter, create_remote_user):
     with pytest.raises(PermissionDenied):
         backends.SSOMigrationBackend().authenticate(request=None, claims=claims)
     user_getter.assert_called_with(
-        username__iexact="testuser", email__iexact="testuser@nelen-schuurmans.nl"
+        nens_auth_username_lower="testuser",
+        nens_auth_email_lower="testuser@nelen-schuurmans.nl",
     )
     assert not create_remote_user.called
 
@@ -146,7 +209,8 @@ def test_ssomigration_inactive(user_getter, create_remote_user):
     with pytest.raises(PermissionDenied):
         backends.SSOMigrationBackend().authenticate(request=None, claims=claims)
     user_getter.assert_called_with(
-        username__iexact="testuser", email__iexact="testuser@nelen-schuurmans.nl"
+        nens_auth_username_lower="testuser",
+        nens_auth_email_lower="testuser@nelen-schuurmans.nl",
     )
     assert not create_remote_user.called
 
@@ -172,7 +236,8 @@ def test_ssomigration_google_nens_ok(user_getter, create_remote_user):
     user = backends.SSOMigrationBackend().authenticate(request=None, claims=claims)
     assert user.username == "testuser"
     user_getter.assert_called_with(
-        username__iexact="testuser", email__iexact="testuser@nelen-schuurmans.nl"
+        nens_auth_username_lower="testuser",
+        nens_auth_email_lower="testuser@nelen-schuurmans.nl",
     )
     create_remote_user.assert_called_with(user, claims)
 
@@ -192,7 +257,8 @@ def test_ssomigration_google_nens_ok_even_capitalized(user_getter, create_remote
     user = backends.SSOMigrationBackend().authenticate(request=None, claims=claims)
     assert user.username == "testuser"
     user_getter.assert_called_with(
-        username__iexact="testuser", email__iexact="testuser@Nelen-Schuurmans.nl"
+        nens_auth_username_lower="testuser",
+        nens_auth_email_lower="testuser@nelen-schuurmans.nl",
     )
     create_remote_user.assert_called_with(user, claims)
 
@@ -421,3 +487,88 @@ def test_trusted_backend_create_new_user(user_getter, create_user, settings):
     )
     assert user == create_user.return_value
     create_user.assert_called_once_with(claims)
+
+
+@pytest.fixture
+def get_candidates(mocker, settings, user_getter):
+    settings.NENS_AUTH_COMBINED_BACKENDS = [
+        "nens_auth_client.backends.RemoteUserBackend",
+        "nens_auth_client.backends.SSOMigrationBackend",
+    ]
+    # No associated (remote) user by default
+    user_getter.side_effect = ObjectDoesNotExist
+    return mocker.patch.object(backends.CombinedBackend, "get_candidates")
+
+
+SSO_CLAIMS = {
+    "sub": "remote-uid",
+    "cognito:username": "testuser",
+    "custom:from_sso": "1",
+    "email": "testuser@nelen-schuurmans.nl",
+}
+
+
+def test_combined_backend_lookups(get_candidates, user_getter):
+    get_candidates.return_value = []
+    user = backends.CombinedBackend().authenticate(request=None, claims=SSO_CLAIMS)
+    assert user is None
+    # The RemoteUserBackend is tried on its own first
+    user_getter.assert_called_once_with(remote__external_user_id="remote-uid")
+    get_candidates.assert_called_once_with(
+        [
+            {
+                "nens_auth_username_lower": "testuser",
+                "nens_auth_email_lower": "testuser@nelen-schuurmans.nl",
+            },
+        ]
+    )
+
+
+def test_combined_backend_remote_user(get_candidates, user_getter, create_remote_user):
+    remote_user = User(username="remote")
+    user_getter.side_effect = None
+    user_getter.return_value = remote_user
+
+    user = backends.CombinedBackend().authenticate(request=None, claims=SSO_CLAIMS)
+    assert user is remote_user
+    assert not get_candidates.called
+    assert not create_remote_user.called
+
+
+def test_combined_backend_second(get_candidates, create_remote_user):
+    sso_user = User(username="sso")
+    get_candidates.return_value = [(0, sso_user)]
+
+    user = backends.CombinedBackend().authenticate(request=None, claims=SSO_CLAIMS)
+    assert user is sso_user
+    create_remote_user.assert_called_once_with(sso_user, SSO_CLAIMS)
+
+
+def test_combined_backend_multiple(get_candidates, create_remote_user):
+    get_candidates.return_value = [
+        (0, User(username="sso1")),
+        (0, User(username="sso2")),
+    ]
+
+    with pytest.raises(PermissionDenied):
+        backends.CombinedBackend().authenticate(request=None, claims=SSO_CLAIMS)
+
+
+def test_combined_backend_skips_lookups(get_candidates, user_getter):
+    user = backends.CombinedBackend().authenticate(
+        request=None, claims={"sub": "remote-uid"}
+    )
+    assert user is None
+    user_getter.assert_called_once_with(remote__external_user_id="remote-uid")
+    # SSOMigrationBackend does not apply to these claims
+    assert not get_candidates.called
+
+
+def test_combined_backend_remote_user_not_first(get_candidates, settings):
+    settings.NENS_AUTH_COMBINED_BACKENDS = [
+        "nens_auth_client.backends.SSOMigrationBackend",
+        "nens_auth_client.backends.RemoteUserBackend",
+    ]
+    get_candidates.return_value = []
+    backends.CombinedBackend().authenticate(request=None, claims=SSO_CLAIMS)
+    assert len(get_candidates.call_args[0][0]) == 2
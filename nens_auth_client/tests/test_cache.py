@@ -0,0 +1,129 @@
+from django.core.cache import caches
+from nens_auth_client.cache import ExpiringLRUCache
+from nens_auth_client.cache import get_or_fetch_shared
+from unittest import mock
+
+import pytest
+import time
+
+
+def test_get_set():
+    cache = ExpiringLRUCache(maxsize=2)
+    cache.set("a", 1, time.time() + 10)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("b", "default") == "default"
+
+
+def test_expired():
+    cache = ExpiringLRUCache(maxsize=2)
+    cache.set("a", 1, time.time() + 10)
+    with mock.patch("nens_auth_client.cache.time.time", return_value=time.time() + 11):
+        assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_already_expired_not_stored():
+    cache = ExpiringLRUCache(maxsize=2)
+    cache.set("a", 1, time.time() - 1)
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    cache = ExpiringLRUCache(maxsize=2)
+    cache.set("a", 1, time.time() + 10)
+    cache.set("b", 2, time.time() + 10)
+    cache.get("a")  # "b" is now least recently used
+    cache.set("c", 3, time.time() + 10)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_disabled():
+    cache = ExpiringLRUCache(maxsize=0)
+    cache.set("a", 1, time.time() + 10)
+    assert cache.get("a") is None
+
+
+def test_delete_clear():
+    cache = ExpiringLRUCache(maxsize=2)
+    cache.set("a", 1, time.time() + 10)
+    cache.set("b", 2, time.time() + 10)
+    cache.delete("a")
+    assert cache.get("a") is None
+    cache.clear()
+    assert len(cache) == 0
+
+
+@pytest.fixture
+def shared_cache(settings):
+    settings.NENS_AUTH_SHARED_CACHE = "default"
+    caches["default"].clear()
+    yield caches["default"]
+    caches["default"].clear()
+
+
+def test_shared_disabled():
+    fetch = mock.Mock(return_value="a")
+    assert get_or_fetch_shared("x", fetch) == "a"
+    assert get_or_fetch_shared("x", fetch) == "a"
+    assert fetch.call_count == 2
+
+
+def test_shared(shared_cache):
+    fetch = mock.Mock(return_value="a")
+    assert get_or_fetch_shared("x", fetch) == "a"
+    assert get_or_fetch_shared("x", fetch) == "a"
+    assert fetch.call_count == 1
+
+
+def test_shared_outdated(shared_cache):
+    get_or_fetch_shared("x", lambda: "a")
+    assert get_or_fetch_shared("x", lambda: "b", outdated="a") == "b"
+    assert get_or_fetch_shared("x", lambda: "c") == "b"
+
+
+def test_shared_waits_for_lock(shared_cache):
+    get_or_fetch_shared("x", lambda: "a")
+    key = next(iter(shared_cache._cache)).split(":", 2)[-1]
+    shared_cache.add(key + ":lock", True)
+
+    # Another process refreshes the value while we wait
+    def sleep(seconds):
+        shared_cache.set(key, "b")
+
+    fetch = mock.Mock()
+    with mock.patch("nens_auth_client.cache.time.sleep", side_effect=sleep):
+        assert get_or_fetch_shared("x", fetch, outdated="a") == "b"
+    assert not fetch.called
+
+
+def test_shared_lock_timeout(shared_cache, settings):
+    get_or_fetch_shared("x", lambda: "a")
+    key = next(iter(shared_cache._cache)).split(":", 2)[-1]
+    shared_cache.add(key + ":lock", True)
+
+    # The other process holds the lock for too long: fetch anyway
+    settings.NENS_AUTH_TIMEOUT = 0
+    assert get_or_fetch_shared("x", lambda: "b", outdated="a") == "b"
+
+
+def test_shared_outdated_callable(shared_cache):
+    get_or_fetch_shared("x", lambda: "a")
+    assert get_or_fetch_shared("x", lambda: "b", outdated=lambda v: v == "b") == "a"
+    assert get_or_fetch_shared("x", lambda: "b", outdated=lambda v: v == "a") == "b"
+
+
+def test_shared_alias_and_timeout(settings):
+    settings.NENS_AUTH_SHARED_CACHE = None
+    cache = mock.Mock()
+    cache.get.return_value = None
+    with mock.patch("nens_auth_client.cache.caches", {"other": cache}):
+        value = get_or_fetch_shared(
+            "x", lambda: 5, alias="other", timeout=lambda v: v * 2
+        )
+
+    assert value == 5
+    _, kwargs = cache.set.call_args
+    assert kwargs["timeout"] == 10
@@ -1,8 +1,17 @@
+from asgiref.sync import async_to_sync
+from asgiref.sync import iscoroutinefunction
 from authlib.jose.errors import JoseError
+from authlib.oidc.discovery import get_well_known_url
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ImproperlyConfigured
+from nens_auth_client.checks import check_bearer_exclude_url_names
 from nens_auth_client.middleware import AccessTokenMiddleware
+from nens_auth_client.middleware import compile_excluded_paths
+from nens_auth_client.middleware import get_bearer_memo
+from nens_auth_client.oauth_base import BaseOAuthClient
+from unittest import mock
 
 import pytest
 
@@ -52,6 +61,7 @@ def test_middleware(
     mocked_authenticate.assert_called_once_with(
         r, claims=mocked_oauth_client.parse_access_token.return_value
     )
+    assert get_bearer_memo(r, token) == ({"scope": "foo"}, processed_request.user)
 
 
 def test_middleware_logged_in_user(
@@ -87,6 +97,36 @@ def test_middleware_invalid_token(
         token, leeway=settings.NENS_AUTH_LEEWAY
     )
     assert not mocked_authenticate.called
+    assert get_bearer_memo(r, token) == (None, None)
+
+
+@pytest.fixture
+def real_oauth_client(mocker):
+    client = BaseOAuthClient(
+        "foo",
+        server_metadata_url=get_well_known_url(
+            settings.NENS_AUTH_ISSUER, external=True
+        ),
+    )
+    mocker.patch("nens_auth_client.middleware.get_oauth_client", return_value=client)
+    return client
+
+
+def test_middleware_unknown_kid(
+    r,
+    access_token_generator,
+    jwks_request,
+    real_oauth_client,
+    mocked_authenticate,
+    middleware,
+):
+    token = access_token_generator(kid="unknown")
+    r.META["HTTP_AUTHORIZATION"] = "Bearer " + token
+
+    processed_request = middleware(r)
+    assert not processed_request.user.is_authenticated
+    assert not mocked_authenticate.called
+    assert get_bearer_memo(r, token) == (None, None)
 
 
 def test_middleware_no_authentication(
@@ -106,3 +146,200 @@ def test_middleware_no_authentication(
     mocked_authenticate.assert_called_once_with(
         r, claims=mocked_oauth_client.parse_access_token.return_value
     )
+
+
+@pytest.fixture
+def async_middleware():
+    async def get_response(request):
+        return request
+
+    return AccessTokenMiddleware(get_response=get_response)
+
+
+@pytest.fixture
+def mocked_aauthenticate(mocker):
+    aauthenticate = mocker.patch(
+        "django.contrib.auth.aauthenticate", new_callable=mock.AsyncMock
+    )
+    aauthenticate.return_value = UserModel(username="testuser")
+    return aauthenticate
+
+
+def test_async_middleware(
+    r,
+    access_token_generator,
+    mocked_oauth_client,
+    mocked_aauthenticate,
+    async_middleware,
+):
+    mocked_oauth_client.aparse_access_token = mock.AsyncMock(
+        return_value={"scope": "foo"}
+    )
+    token = access_token_generator()
+    r.META["HTTP_AUTHORIZATION"] = "Bearer " + token
+
+    assert iscoroutinefunction(async_middleware)
+    processed_request = async_to_sync(async_middleware)(r)
+    assert processed_request.user.username == "testuser"
+    assert processed_request.user.oauth2_scope == "foo"
+    assert async_to_sync(processed_request.auser)() is processed_request.user
+
+    mocked_oauth_client.aparse_access_token.assert_awaited_once_with(
+        token, leeway=settings.NENS_AUTH_LEEWAY
+    )
+    mocked_aauthenticate.assert_awaited_once_with(r, claims={"scope": "foo"})
+
+
+def test_async_middleware_logged_in_user(
+    r, access_token_generator, mocked_oauth_client, async_middleware
+):
+    r.user = UserModel(username="otheruser")
+    r.META["HTTP_AUTHORIZATION"] = "Bearer " + access_token_generator()
+    processed_request = async_to_sync(async_middleware)(r)
+    assert processed_request.user.username == "otheruser"
+
+    assert not mocked_oauth_client.aparse_access_token.called
+
+
+def test_async_middleware_invalid_token(
+    r,
+    access_token_generator,
+    mocked_oauth_client,
+    mocked_aauthenticate,
+    async_middleware,
+):
+    mocked_oauth_client.aparse_access_token = mock.AsyncMock(side_effect=JoseError())
+    r.META["HTTP_AUTHORIZATION"] = "Bearer " + access_token_generator()
+
+    processed_request = async_to_sync(async_middleware)(r)
+    assert not processed_request.user.is_authenticated
+    assert not mocked_aauthenticate.called
+
+
+def test_async_middleware_unknown_kid(
+    r,
+    access_token_generator,
+    jwks_request,
+    real_oauth_client,
+    mocked_aauthenticate,
+    async_middleware,
+):
+    r.META["HTTP_AUTHORIZATION"] = "Bearer " + access_token_generator(kid="unknown")
+
+    processed_request = async_to_sync(async_middleware)(r)
+    assert not processed_request.user.is_authenticated
+    assert not mocked_aauthenticate.called
+
+
+def test_middleware_lazy(
+    r,
+    access_token_generator,
+    mocked_oauth_client,
+    mocked_authenticate,
+    middleware,
+    settings,
+):
+    settings.NENS_AUTH_LAZY_BEARER = True
+    token = access_token_generator()
+    r.META["HTTP_AUTHORIZATION"] = "Bearer " + token
+
+    processed_request = middleware(r)
+    assert not mocked_oauth_client.parse_access_token.called
+
+    assert processed_request.user.username == "testuser"
+    assert processed_request.user.oauth2_scope == "foo"
+    assert processed_request.user.username == "testuser"
+    mocked_oauth_client.parse_access_token.assert_called_once()
+    mocked_authenticate.assert_called_once()
+
+
+def test_middleware_lazy_logged_in_user(
+    r, access_token_generator, mocked_oauth_client, middleware, settings
+):
+    settings.NENS_AUTH_LAZY_BEARER = True
+    r.user = UserModel(username="otheruser")
+    r.META["HTTP_AUTHORIZATION"] = "Bearer " + access_token_generator()
+
+    processed_request = middleware(r)
+    assert processed_request.user.username == "otheruser"
+    assert not mocked_oauth_client.parse_access_token.called
+
+
+def test_middleware_lazy_invalid_token(
+    r,
+    access_token_generator,
+    mocked_oauth_client,
+    mocked_authenticate,
+    middleware,
+    settings,
+):
+    settings.NENS_AUTH_LAZY_BEARER = True
+    mocked_oauth_client.parse_access_token.side_effect = JoseError()
+    r.META["HTTP_AUTHORIZATION"] = "Bearer " + access_token_generator()
+
+    processed_request = middleware(r)
+    assert not processed_request.user.is_authenticated
+    assert not mocked_authenticate.called
+
+
+def test_async_middleware_lazy(
+    r,
+    access_token_generator,
+    mocked_oauth_client,
+    mocked_authenticate,
+    async_middleware,
+    settings,
+):
+    settings.NENS_AUTH_LAZY_BEARER = True
+    r.META["HTTP_AUTHORIZATION"] = "Bearer " + access_token_generator()
+
+    processed_request = async_to_sync(async_middleware)(r)
+    assert not mocked_oauth_client.parse_access_token.called
+
+    user = async_to_sync(processed_request.auser)()
+    assert user.username == "testuser"
+    assert processed_request.user.username == "testuser"
+    mocked_oauth_client.parse_access_token.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "path,expected",
+    [
+        ("/health/", True),
+        ("/static/css/style.css", True),
+        ("/logout/", True),
+        ("/logout/other/", False),
+        ("/login/", False),
+        ("/", False),
+    ],
+)
+def test_compile_excluded_paths(path, expected):
+    is_excluded = compile_excluded_paths(["/health/", "/static/"], ["logout"])
+    assert is_excluded(path) is expected
+
+
+def test_compile_excluded_paths_with_arguments():
+    with pytest.raises(ImproperlyConfigured):
+        compile_excluded_paths([], ["accept_invitation"])
+
+
+@pytest.mark.parametrize(
+    "url_names,n_errors",
+    [([], 0), (["logout"], 0), (["accept_invitation"], 1), (["nonexisting"], 1)],
+)
+def test_check_bearer_exclude_url_names(url_names, n_errors, settings):
+    settings.NENS_AUTH_BEARER_EXCLUDE_URL_NAMES = url_names
+    assert len(check_bearer_exclude_url_names()) == n_errors
+
+
+def test_middleware_excluded_path(
+    rf, access_token_generator, mocked_oauth_client, middleware, settings
+):
+    settings.NENS_AUTH_BEARER_EXCLUDE_PATHS = ["/health/"]
+    request = rf.get("/health/ready")
+    request.user = AnonymousUser()
+    request.META["HTTP_AUTHORIZATION"] = "Bearer " + access_token_generator()
+
+    processed_request = middleware(request)
+    assert not processed_request.user.is_authenticated
+    assert not mocked_oauth_client.parse_access_token.called
@@ -0,0 +1,28 @@
+from django.db.models import Model
+from nens_auth_client.models import RemoteUser
+from unittest import mock
+
+
+def test_remote_user_tokens():
+    remote_user = RemoteUser(external_user_id="abc", access_token="foo")
+
+    assert remote_user.access_token == "foo"
+    assert remote_user.id_token == ""
+    assert remote_user.tokens.access_token == "foo"
+
+
+def test_remote_user_save_tokens():
+    remote_user = RemoteUser(external_user_id="abc", refresh_token="bar")
+
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            self.pk = 3
+
+    with mock.patch.object(Model, "save", autospec=True, side_effect=save) as m:
+        remote_user.save()
+        assert m.call_count == 2  # the RemoteUser and its tokens
+        remote_user.save()
+        assert m.call_count == 3  # the tokens did not change
+
+    assert remote_user.tokens.remote_user_id == 3
+    assert remote_user.tokens.refresh_token == "bar"
@@ -1,6 +1,13 @@
 from authlib.jose.errors import JoseError
+from authlib.oidc.discovery import get_well_known_url
+from django.core.management import call_command
+from nens_auth_client.oauth import _revalidate
 from nens_auth_client.oauth import get_oauth_client
+from nens_auth_client.oauth import preload_snapshot
+from nens_auth_client.oauth_base import BaseOAuthClient
 
+import io
+import json
 import pytest
 import time
 
@@ -46,3 +53,94 @@ def test_parse_token_invalid_key_id(access_token_generator, jwks_request):
     token = access_token_generator(kid="unknown_key_id")
     with pytest.raises(ValueError):
         get_oauth_client().parse_access_token(token)
+
+
+@pytest.fixture
+def snapshot(openid_configuration, jwks, settings):
+    return {
+        "server_metadata_url": get_well_known_url(
+            settings.NENS_AUTH_ISSUER, external=True
+        ),
+        "metadata": openid_configuration,
+        "jwks": jwks,
+    }
+
+
+@pytest.fixture
+def oauth_client(settings):
+    return BaseOAuthClient(
+        "foo",
+        server_metadata_url=get_well_known_url(
+            settings.NENS_AUTH_ISSUER, external=True
+        ),
+    )
+
+
+@pytest.fixture
+def mocked_thread(mocker):
+    return mocker.patch("nens_auth_client.oauth.threading.Thread")
+
+
+def test_preload_snapshot(tmp_path, snapshot, oauth_client, mocked_thread):
+    path = tmp_path / "snapshot.json"
+    path.write_text(json.dumps(snapshot))
+
+    assert preload_snapshot(oauth_client, str(path))
+    # no requests are required to get the JWK set
+    assert oauth_client.fetch_jwk_set() == snapshot["jwks"]
+    # revalidation is started in the background
+    mocked_thread.assert_called_once()
+    assert mocked_thread.call_args[1]["target"] is _revalidate
+    mocked_thread.return_value.start.assert_called_once_with()
+
+
+def test_preload_snapshot_other_server(tmp_path, snapshot, oauth_client, mocked_thread):
+    snapshot["server_metadata_url"] = "https://other/.well-known/openid-configuration"
+    path = tmp_path / "snapshot.json"
+    path.write_text(json.dumps(snapshot))
+
+    assert not preload_snapshot(oauth_client, str(path))
+    assert "jwks" not in oauth_client.server_metadata
+    assert not mocked_thread.called
+
+
+@pytest.mark.parametrize(
+    "modification",
+    [
+        lambda snapshot: [snapshot],
+        lambda snapshot: {**snapshot, "metadata": None},
+        lambda snapshot: {k: v for (k, v) in snapshot.items() if k != "jwks"},
+        lambda snapshot: {**snapshot, "jwks": {"keys": [{"kty": "RSA"}]}},
+    ],
+)
+def test_preload_snapshot_invalid(
+    tmp_path, snapshot, oauth_client, mocked_thread, modification
+):
+    path = tmp_path / "snapshot.json"
+    path.write_text(json.dumps(modification(snapshot)))
+
+    assert not preload_snapshot(oauth_client, str(path))
+    assert "jwks" not in oauth_client.server_metadata
+    assert not mocked_thread.called
+
+
+def test_preload_snapshot_missing(tmp_path, oauth_client, mocked_thread):
+    assert not preload_snapshot(oauth_client, str(tmp_path / "nonexisting.json"))
+
+
+def test_snapshot_command(tmp_path, jwks_request, jwks, openid_configuration):
+    path = tmp_path / "snapshot.json"
+    call_command("snapshot_server_metadata", str(path), stdout=io.StringIO())
+
+    snapshot = json.loads(path.read_text())
+    assert snapshot["metadata"] == openid_configuration
+    assert snapshot["jwks"] == jwks
+
+
+def test_snapshot_command_replaces_file(tmp_path, jwks_request, jwks):
+    path = tmp_path / "snapshot.json"
+    path.write_text("old")
+    call_command("snapshot_server_metadata", str(path), stdout=io.StringIO())
+
+    assert json.loads(path.read_text())["jwks"] == jwks
+    assert list(tmp_path.iterdir()) == [path]  # no temporary files left
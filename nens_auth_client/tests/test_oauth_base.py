@@ -1,9 +1,16 @@
+from asgiref.sync import async_to_sync
+from authlib.jose import JsonWebToken
+from authlib.jose import jwt
+from authlib.jose.errors import DecodeError
 from authlib.jose.errors import JoseError
 from authlib.oidc.discovery import get_well_known_url
 from django.conf import settings
+from django.core.cache import caches
 from nens_auth_client.oauth_base import BaseOAuthClient
 from unittest import mock
 
+import base64
+import json
 import pytest
 import time
 
@@ -62,3 +69,357 @@ def test_parse_access_token_preprocess_err(
     ):
         with pytest.raises(JoseError):
             oauth_client.parse_access_token(access_token_generator())
+
+
+def test_parse_access_token_cached(
+    access_token_generator, jwks_request, oauth_client, mocker
+):
+    token = access_token_generator()
+    claims = oauth_client.parse_access_token(token)
+
+    decode = mocker.spy(JsonWebToken, "decode")
+    cached_claims = oauth_client.parse_access_token(token)
+
+    assert not decode.called
+    assert cached_claims == claims
+    assert cached_claims is not claims
+
+
+def test_parse_access_token_cache_expired(
+    access_token_generator, jwks_request, oauth_client, mocker
+):
+    token = access_token_generator()
+    oauth_client.parse_access_token(token)
+
+    decode = mocker.spy(JsonWebToken, "decode")
+    with mock.patch("nens_auth_client.cache.time.time", return_value=time.time() + 11):
+        oauth_client.parse_access_token(token)
+
+    assert decode.called
+
+
+def test_parse_access_token_not_cached_with_claims_options(
+    access_token_generator, jwks_request, oauth_client
+):
+    token = access_token_generator()
+    oauth_client.parse_access_token(token, claims_options={"jti": {"value": "abcd"}})
+    assert len(oauth_client.access_token_cache) == 0
+
+
+def test_parse_access_token_cache_disabled(
+    access_token_generator, jwks_request, settings
+):
+    settings.NENS_AUTH_ACCESS_TOKEN_CACHE_SIZE = 0
+    oauth_client = BaseOAuthClient(
+        "foo",
+        server_metadata_url=get_well_known_url(
+            settings.NENS_AUTH_ISSUER, external=True
+        ),
+    )
+    oauth_client.parse_access_token(access_token_generator())
+    assert len(oauth_client.access_token_cache) == 0
+
+
+def test_load_key(jwks, oauth_client):
+    oauth_client.server_metadata["jwks"] = jwks
+    key = oauth_client.load_key({"kid": jwks["keys"][0]["kid"]}, {})
+    assert key.kid == jwks["keys"][0]["kid"]
+
+
+def test_load_key_reuses_index(jwks, oauth_client):
+    oauth_client.server_metadata["jwks"] = jwks
+    oauth_client.load_key({"kid": jwks["keys"][0]["kid"]}, {})
+    with mock.patch("nens_auth_client.oauth_base.JsonWebKey") as JsonWebKey:
+        oauth_client.load_key({"kid": jwks["keys"][0]["kid"]}, {})
+    assert not JsonWebKey.import_key_set.called
+
+
+def test_load_key_rebuilds_index_on_change(jwks, private_key, oauth_client):
+    oauth_client.server_metadata["jwks"] = jwks
+    oauth_client.load_key({"kid": jwks["keys"][0]["kid"]}, {})
+    new_key = {**jwks["keys"][0], "kid": "new_kid"}
+    oauth_client.server_metadata["jwks"] = {"keys": [new_key]}
+    assert oauth_client.load_key({"kid": "new_kid"}, {}).kid == "new_kid"
+
+
+def test_load_key_unknown_kid(jwks_request, oauth_client):
+    with pytest.raises(ValueError):
+        oauth_client.load_key({"kid": "unknown"}, {})
+
+
+def count_jwks_requests(rq_mocker, openid_configuration):
+    return sum(
+        1
+        for r in rq_mocker.request_history
+        if r.url == openid_configuration["jwks_uri"]
+    )
+
+
+def test_load_key_unknown_kid_rate_limited(
+    jwks_request, rq_mocker, openid_configuration, oauth_client
+):
+    with pytest.raises(ValueError):
+        oauth_client.load_key({"kid": "unknown"}, {})
+    # initial fetch + forced refresh
+    assert count_jwks_requests(rq_mocker, openid_configuration) == 2
+
+    # the same kid is rejected locally (negative cache)
+    with pytest.raises(ValueError):
+        oauth_client.load_key({"kid": "unknown"}, {})
+    # another unknown kid is rejected locally (rate limit)
+    with pytest.raises(ValueError):
+        oauth_client.load_key({"kid": "other"}, {})
+    assert count_jwks_requests(rq_mocker, openid_configuration) == 2
+
+
+def test_load_key_unknown_kid_refresh_after_interval(
+    jwks_request, rq_mocker, openid_configuration, oauth_client, settings
+):
+    with pytest.raises(ValueError):
+        oauth_client.load_key({"kid": "unknown"}, {})
+
+    later = time.time() + settings.NENS_AUTH_JWKS_MIN_REFRESH_INTERVAL + 1
+    with mock.patch("time.time", return_value=later):
+        with pytest.raises(ValueError):
+            oauth_client.load_key({"kid": "unknown"}, {})
+    assert count_jwks_requests(rq_mocker, openid_configuration) == 3
+
+
+def test_load_key_new_kid_after_refresh(
+    jwks, rq_mocker, openid_configuration, oauth_client
+):
+    # The cached JWK set is outdated: the key was rotated
+    oauth_client.server_metadata["jwks"] = {"keys": []}
+    rq_mocker.get(openid_configuration["jwks_uri"], json=jwks)
+    kid = jwks["keys"][0]["kid"]
+    assert oauth_client.load_key({"kid": kid}, {}).kid == kid
+
+
+def test_load_key_invalid_kid_type(jwks, oauth_client):
+    oauth_client.server_metadata["jwks"] = jwks
+    with pytest.raises(ValueError):
+        oauth_client.load_key({"kid": ["a"]}, {})
+
+
+def test_load_server_metadata_force(rq_mocker, openid_configuration, oauth_client):
+    oauth_client.load_server_metadata()
+    rq_mocker.get(
+        oauth_client._server_metadata_url,
+        json={**openid_configuration, "issuer": "new-issuer"},
+    )
+    assert oauth_client.load_server_metadata()["issuer"] != "new-issuer"
+    assert oauth_client.load_server_metadata(force=True)["issuer"] == "new-issuer"
+
+
+def test_refresh(jwks, rq_mocker, openid_configuration, oauth_client):
+    oauth_client.server_metadata["jwks"] = {"keys": []}
+    rq_mocker.get(openid_configuration["jwks_uri"], json=jwks)
+    oauth_client.refresh()
+
+    assert oauth_client.server_metadata["jwks"] == jwks
+    assert jwks["keys"][0]["kid"] in oauth_client._jwk_index[1]
+
+
+def test_shared_cache(jwks_request, rq_mocker, openid_configuration, settings):
+    settings.NENS_AUTH_SHARED_CACHE = "default"
+    url = get_well_known_url(settings.NENS_AUTH_ISSUER, external=True)
+    rq_mocker.get(url, json=openid_configuration)
+    try:
+        # Two processes: the second gets the metadata and JWKS from the cache
+        for _ in range(2):
+            oauth_client = BaseOAuthClient("foo", server_metadata_url=url)
+            oauth_client.fetch_jwk_set()
+    finally:
+        caches["default"].clear()
+
+    assert len(rq_mocker.request_history) == 2
+
+
+def test_shared_cache_forced_refresh(
+    jwks_request, rq_mocker, openid_configuration, settings
+):
+    settings.NENS_AUTH_SHARED_CACHE = "default"
+    url = get_well_known_url(settings.NENS_AUTH_ISSUER, external=True)
+    rq_mocker.get(url, json=openid_configuration)
+    try:
+        clients = [BaseOAuthClient("foo", server_metadata_url=url) for _ in range(2)]
+        for client in clients:
+            client.fetch_jwk_set()
+        assert len(rq_mocker.request_history) == 2
+
+        # Two processes refresh (soon) after: the fetched values are reused
+        for client in clients:
+            client.refresh()
+        assert len(rq_mocker.request_history) == 2
+
+        # After the min. refresh interval, a refresh fetches again
+        with mock.patch("time.time", return_value=time.time() + 61):
+            for client in clients:
+                client.refresh()
+        assert len(rq_mocker.request_history) == 4
+    finally:
+        caches["default"].clear()
+
+
+def test_token_decoder_reused(jwks_request, oauth_client):
+    assert oauth_client.get_token_decoder() is not None
+    jwt, claims_options = oauth_client.get_token_decoder()
+    assert oauth_client.get_token_decoder()[0] is jwt
+    assert claims_options["aud"]["value"] == settings.NENS_AUTH_RESOURCE_SERVER_ID
+
+
+def test_token_decoder_settings_changed(
+    access_token_generator, jwks_request, oauth_client, settings
+):
+    oauth_client.parse_access_token(access_token_generator())
+    jwt, _ = oauth_client.get_token_decoder()
+
+    settings.NENS_AUTH_RESOURCE_SERVER_ID = "https://other/"
+    new_jwt, claims_options = oauth_client.get_token_decoder()
+    assert new_jwt is not jwt
+    assert claims_options["aud"]["value"] == "https://other/"
+    assert len(oauth_client.access_token_cache) == 0
+
+
+def test_token_decoder_metadata_changed(rq_mocker, openid_configuration, oauth_client):
+    jwt, _ = oauth_client.get_token_decoder()
+
+    # Unchanged metadata: reuse the decoder
+    oauth_client.load_server_metadata(force=True)
+    assert oauth_client.get_token_decoder()[0] is jwt
+
+    rq_mocker.get(
+        oauth_client._server_metadata_url,
+        json={**openid_configuration, "issuer": "new-issuer"},
+    )
+    oauth_client.load_server_metadata(force=True)
+    new_jwt, claims_options = oauth_client.get_token_decoder()
+    assert new_jwt is not jwt
+    assert claims_options["iss"]["value"] == "new-issuer"
+
+
+def test_parse_access_tokens(
+    access_token_generator, jwks_request, oauth_client, mocker
+):
+    token_1 = access_token_generator(sub="user_1")
+    token_2 = access_token_generator(sub="user_2")
+    load_key = mocker.spy(oauth_client, "load_key")
+
+    result = oauth_client.parse_access_tokens([token_1, token_2, token_1])
+
+    assert list(result) == [token_1, token_2]
+    assert result[token_1]["sub"] == "user_1"
+    assert result[token_2]["sub"] == "user_2"
+    # the key is looked up once for both tokens
+    load_key.assert_called_once()
+
+
+def test_parse_access_tokens_generator(
+    access_token_generator, jwks_request, oauth_client
+):
+    token = access_token_generator()
+    result = oauth_client.parse_access_tokens(t for t in [token])
+    assert result[token]["sub"] == "some_sub"
+
+
+def test_parse_access_tokens_errors(access_token_generator, jwks_request, oauth_client):
+    valid = access_token_generator()
+    expired = access_token_generator(exp=0)
+    unknown_kid = access_token_generator(kid="unknown")
+
+    result = oauth_client.parse_access_tokens([valid, expired, unknown_kid, "abc"])
+
+    assert result[valid]["sub"] == "some_sub"
+    assert isinstance(result[expired], JoseError)
+    assert isinstance(result[unknown_kid], ValueError)
+    assert isinstance(result["abc"], JoseError)
+
+
+def test_parse_access_tokens_cached(
+    access_token_generator, jwks_request, oauth_client, mocker
+):
+    token = access_token_generator()
+    claims = oauth_client.parse_access_token(token)
+    load_key = mocker.spy(oauth_client, "load_key")
+
+    assert oauth_client.parse_access_tokens([token]) == {token: claims}
+    assert not load_key.called
+
+
+def test_aparse_access_token(access_token_generator, jwks_request, oauth_client):
+    token = access_token_generator()
+    claims = async_to_sync(oauth_client.aparse_access_token)(token)
+    assert claims["sub"] == "some_sub"
+
+    # The second time, the claims are taken from the cache
+    with mock.patch.object(oauth_client, "parse_access_token") as parse_access_token:
+        assert async_to_sync(oauth_client.aparse_access_token)(token) == claims
+    assert not parse_access_token.called
+
+
+def test_aparse_access_token_no_decoder(
+    access_token_generator, jwks_request, oauth_client
+):
+    # Without a token decoder, everything (incl. discovery) is done in a thread
+    with mock.patch.object(oauth_client, "parse_access_token") as parse_access_token:
+        with mock.patch.object(oauth_client, "get_token_decoder") as get_decoder:
+            async_to_sync(oauth_client.aparse_access_token)("token")
+    parse_access_token.assert_called_once_with("token", claims_options=None, leeway=120)
+    assert not get_decoder.called
+
+
+def test_check_access_token(access_token_generator, jwks_request, oauth_client):
+    header = oauth_client.check_access_token(access_token_generator())
+    assert header["alg"] == "RS256"
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        "abc",
+        "a.b",
+        "a.b.c.d",
+        "a..c",
+        "!!!.b.c",
+        "x" * 8193,
+    ],
+)
+def test_check_access_token_malformed(token, oauth_client, jwks_request):
+    with pytest.raises(JoseError):
+        oauth_client.check_access_token(token)
+
+
+def test_check_access_token_alg(jwks_request, oauth_client):
+    token = jwt.encode({"alg": "HS256"}, {"sub": "x"}, "secret").decode()
+    with pytest.raises(JoseError):
+        oauth_client.check_access_token(token)
+
+
+@pytest.mark.parametrize("alg", [["RS256"], {}, None])
+def test_check_access_token_alg_not_a_string(alg, jwks_request, oauth_client):
+    header = base64.urlsafe_b64encode(json.dumps({"alg": alg}).encode()).decode()
+    with pytest.raises(DecodeError):
+        oauth_client.check_access_token(header.rstrip("=") + ".b.c")
+
+
+def test_check_access_token_unknown_kid(
+    access_token_generator, jwks_request, oauth_client
+):
+    token = access_token_generator(kid="unknown")
+    # The first time, a refresh of the JWK set is allowed
+    oauth_client.check_access_token(token)
+    with pytest.raises(ValueError):
+        oauth_client.parse_access_token(token)
+    # After that, the token is rejected without refreshing
+    with mock.patch.object(oauth_client, "refresh_key_index") as refresh_key_index:
+        with pytest.raises(ValueError):
+            oauth_client.check_access_token(token)
+    assert not refresh_key_index.called
+
+
+def test_parse_access_token_too_long(jwks_request, oauth_client, settings, mocker):
+    settings.NENS_AUTH_MAX_TOKEN_LENGTH = 10
+    decode = mocker.spy(JsonWebToken, "decode")
+    with pytest.raises(JoseError):
+        oauth_client.parse_access_token("x" * 11)
+    assert not decode.called
@@ -0,0 +1,116 @@
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.db import connection
+from nens_auth_client.admin import RemoteUserAdmin
+from nens_auth_client.backends import _user_queryset
+from nens_auth_client.backends import CombinedBackend
+from nens_auth_client.backends import RemoteUserBackend
+from nens_auth_client.models import RemoteUser
+from nens_auth_client.users import _create_user
+
+import pytest
+
+# Regression tests: internal queries should not load the (large) tokens.
+
+LARGE_TOKEN = "x" * 4096
+
+
+@pytest.fixture
+def remote_user(db):
+    user = User.objects.create_user(username="testuser")
+    remote_user = RemoteUser(
+        user=user,
+        external_user_id="abc",
+        id_token=LARGE_TOKEN,
+        access_token=LARGE_TOKEN,
+        refresh_token=LARGE_TOKEN,
+    )
+    remote_user.save()
+    return remote_user
+
+
+def assert_no_tokens(queries):
+    for query in queries:
+        assert "token" not in query["sql"]
+
+
+def test_backend(remote_user, django_assert_num_queries):
+    with django_assert_num_queries(1) as context:
+        user = RemoteUserBackend().authenticate(None, claims={"sub": "abc"})
+
+    assert user == remote_user.user
+    assert_no_tokens(context.captured_queries)
+
+
+def test_create_user_exists(remote_user, django_assert_max_num_queries):
+    with django_assert_max_num_queries(6) as context:
+        assert _create_user("otheruser", "abc") is None
+
+    assert_no_tokens(context.captured_queries)
+
+
+def test_admin_changelist(remote_user, rf, django_assert_num_queries):
+    model_admin = RemoteUserAdmin(RemoteUser, AdminSite())
+    request = rf.get("/")
+    with django_assert_num_queries(1) as context:
+        remote_users = list(model_admin.get_queryset(request))
+
+    assert remote_users == [remote_user]
+    assert_no_tokens(context.captured_queries)
+
+
+@pytest.fixture
+def combined_settings(settings):
+    settings.NENS_AUTH_COMBINED_BACKENDS = [
+        "nens_auth_client.backends.RemoteUserBackend",
+        "nens_auth_client.backends.SSOMigrationBackend",
+        "nens_auth_client.backends.TrustedProviderMigrationBackend",
+    ]
+    settings.NENS_AUTH_TRUSTED_PROVIDERS = ["Azure"]
+
+
+@pytest.mark.parametrize("sub,num_queries", [("abc", 1), ("new-sub", 2)])
+def test_combined_backend(
+    sub, num_queries, remote_user, combined_settings, django_assert_num_queries, mocker
+):
+    mocker.patch("nens_auth_client.backends.create_remote_user")
+    remote_user.user.email = "testuser@example.com"
+    remote_user.user.save()
+    claims = {
+        "sub": sub,
+        "cognito:username": "testuser",
+        "custom:from_sso": "1",
+        "email": "TestUser@example.com",
+        "identities": [{"providerName": "Azure"}],
+    }
+    # An associated user is found without the UNION query
+    with django_assert_num_queries(num_queries) as context:
+        user = CombinedBackend().authenticate(None, claims=claims)
+
+    assert user == remote_user.user
+    assert not hasattr(user, "nens_auth_step")
+    assert ("UNION" in context.captured_queries[-1]["sql"]) is (num_queries == 2)
+
+
+def test_combined_backend_not_found(
+    remote_user, combined_settings, django_assert_num_queries
+):
+    claims = {"sub": "new-sub", "email": "other@example.com"}
+    with django_assert_num_queries(1):
+        assert CombinedBackend().authenticate(None, claims=claims) is None
+
+
+@pytest.mark.parametrize(
+    "lookup,index",
+    [
+        ({"nens_auth_email_lower": "a@b.nl"}, "nens_auth_user_email_lower"),
+        ({"nens_auth_username_lower": "a"}, "nens_auth_user_username_lower"),
+    ],
+)
+def test_lower_lookup_uses_index(db, lookup, index):
+    sql, params = _user_queryset().filter(**lookup).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        plan = str(cursor.fetchall())
+
+    assert index in plan
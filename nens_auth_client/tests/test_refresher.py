@@ -0,0 +1,72 @@
+from django.apps import apps
+from nens_auth_client import refresher
+from nens_auth_client.oauth import get_oauth_client
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def mocked_oauth_client(mocker):
+    get_oauth_client = mocker.patch("nens_auth_client.refresher.get_oauth_client")
+    return get_oauth_client.return_value
+
+
+@pytest.fixture
+def stop_refresher():
+    yield
+    refresher.stop_refresher()
+
+
+def run_once(thread):
+    # Run the refresher loop a single time
+    with mock.patch.object(thread._stopped, "wait", lambda _: thread.stop()):
+        thread.run()
+
+
+def test_refresher_refreshes(mocked_oauth_client):
+    run_once(refresher.Refresher(interval=60))
+    mocked_oauth_client.refresh.assert_called_once_with()
+
+
+def test_refresher_survives_errors(mocked_oauth_client):
+    mocked_oauth_client.refresh.side_effect = IOError()
+    run_once(refresher.Refresher(interval=60))
+    mocked_oauth_client.refresh.assert_called_once_with()
+
+
+def test_start_refresher(mocked_oauth_client, stop_refresher):
+    thread = refresher.start_refresher(interval=60)
+    assert thread.is_alive()
+    # Starting again returns the running thread
+    assert refresher.start_refresher(interval=60) is thread
+
+
+def test_start_refresher_after_fork(mocked_oauth_client, stop_refresher, mocker):
+    thread = refresher.start_refresher(interval=60)
+    mocker.patch("os.getpid", return_value=-1)
+    new_thread = refresher.start_refresher(interval=60)
+    assert new_thread is not thread
+    assert new_thread.is_alive()
+    thread.stop()
+
+
+def test_get_oauth_client_starts_refresher(settings, mocker):
+    start_refresher = mocker.patch("nens_auth_client.refresher.start_refresher")
+    settings.NENS_AUTH_BACKGROUND_REFRESH_INTERVAL = 300
+    get_oauth_client()
+    start_refresher.assert_called_once_with(300)
+
+
+def test_get_oauth_client_no_refresher(settings, mocker):
+    start_refresher = mocker.patch("nens_auth_client.refresher.start_refresher")
+    get_oauth_client()
+    assert not start_refresher.called
+
+
+def test_app_ready_no_refresher(settings, mocker):
+    # The refresher is not started when Django starts (e.g. for "migrate")
+    start_refresher = mocker.patch("nens_auth_client.refresher.start_refresher")
+    settings.NENS_AUTH_BACKGROUND_REFRESH_INTERVAL = 300
+    apps.get_app_config("nens_auth_client").ready()
+    assert not start_refresher.called
@@ -1,11 +1,20 @@
+from django.core.cache import caches
 from nens_auth_client.models import RemoteUser
 from nens_auth_client.oauth import get_oauth_client
+from nens_auth_client.requests_session import _get_expires_at
+from nens_auth_client.requests_session import fetch_cc_token
+from nens_auth_client.requests_session import get_http_adapter
+from nens_auth_client.requests_session import normalize_scope
 from nens_auth_client.requests_session import OAuth2CCSession
 from nens_auth_client.requests_session import OAuth2Session
+from requests.adapters import HTTPAdapter
 from unittest import mock
 from urllib.parse import parse_qs
 
 import pytest
+import socket
+import threading
+import time
 
 
 @pytest.fixture
@@ -71,7 +80,9 @@ def test_refresh(rq_mocker, openid_configuration, remote_user):
 
 def test_client_credentials_cached(rq_mocker, openid_configuration):
     client = get_oauth_client()
-    client.cc_token_cache = {"scope1": "cached-token"}
+    client.cc_token_cache = {
+        "scope1": {"access_token": "cached-token", "expires_at": time.time() + 3600}
+    }
 
     session = OAuth2CCSession(scope=["scope1"])
 
@@ -123,7 +134,9 @@ def test_client_credentials_no_cache(rq_mocker, openid_configuration):
 
 def test_client_credentials_refresh(rq_mocker, openid_configuration):
     client = get_oauth_client()
-    client.cc_token_cache = {"scope1": "expired-token"}
+    client.cc_token_cache = {
+        "scope1": {"access_token": "expired-token", "expires_at": None}
+    }
 
     # Mock an API (returns 401 so that refresh is triggered)
     rq_mocker.get("http://api.foo.bar", status_code=401)
@@ -155,3 +168,247 @@ def test_client_credentials_refresh(rq_mocker, openid_configuration):
     # Request with token
     assert request_list[-1].url == "http://api.foo.bar/"
     assert request_list[-1].headers["Authorization"] == "Bearer fetched-token"
+
+
+@pytest.mark.parametrize("expires_in", [-10, 30])
+def test_client_credentials_expired(rq_mocker, openid_configuration, expires_in):
+    # Tokens that (almost) expired are refreshed before sending them
+    client = get_oauth_client()
+    client.cc_token_cache = {
+        "scope1": {
+            "access_token": "expired-token",
+            "expires_at": time.time() + expires_in,
+        }
+    }
+    rq_mocker.get("http://api.foo.bar", status_code=200)
+    rq_mocker.post(
+        openid_configuration["token_endpoint"],
+        json={"access_token": "fetched-token", "expires_in": 3600},
+    )
+
+    session = OAuth2CCSession(scope="scope1")
+    session.get("http://api.foo.bar/")
+
+    request_list = rq_mocker.request_history
+    assert request_list[-1].headers["Authorization"] == "Bearer fetched-token"
+    assert not any(
+        r.headers.get("Authorization") == "Bearer expired-token" for r in request_list
+    )
+    assert client.cc_token_cache["scope1"]["expires_at"] > time.time() + 3500
+
+
+def test_client_credentials_expires_during_session(rq_mocker, openid_configuration):
+    client = get_oauth_client()
+    client.cc_token_cache = {
+        "scope1": {"access_token": "cached-token", "expires_at": time.time() + 3600}
+    }
+    rq_mocker.get("http://api.foo.bar", status_code=200)
+    rq_mocker.post(
+        openid_configuration["token_endpoint"],
+        json={"access_token": "fetched-token", "expires_in": 3600},
+    )
+
+    session = OAuth2CCSession(scope="scope1")
+    session.get("http://api.foo.bar/")
+    client.cc_token_cache["scope1"]["expires_at"] = time.time()
+    session.get("http://api.foo.bar/")
+
+    request_list = rq_mocker.request_history
+    assert request_list[0].headers["Authorization"] == "Bearer cached-token"
+    assert request_list[-1].headers["Authorization"] == "Bearer fetched-token"
+
+
+def test_client_credentials_short_lived(rq_mocker, openid_configuration):
+    # Tokens that live shorter than the refresh margin are reused
+    client = get_oauth_client()
+    client.cc_token_cache = {}
+    rq_mocker.get("http://api.foo.bar", status_code=200)
+    token_request = rq_mocker.post(
+        openid_configuration["token_endpoint"],
+        json={"access_token": "fetched-token", "expires_in": 30},
+    )
+
+    session = OAuth2CCSession(scope="scope1")
+    for _ in range(2):
+        session.get("http://api.foo.bar/")
+
+    assert token_request.call_count == 1
+
+
+def test_get_expires_at_from_claim(access_token_generator):
+    token = access_token_generator(exp=1700000000)
+    assert _get_expires_at({"access_token": token}) == 1700000000
+
+
+@pytest.mark.parametrize(
+    "tokens", [{"access_token": "not-a-jwt"}, {"access_token": "a.b.c"}]
+)
+def test_get_expires_at_unknown(tokens):
+    assert _get_expires_at(tokens) is None
+
+
+def test_fetch_cc_token_single_flight(mocker):
+    client = get_oauth_client()
+    client.cc_token_cache = {
+        "scope1": {"access_token": "rejected-token", "expires_at": None}
+    }
+    fetch_started = threading.Event()
+
+    def fetch_access_token(**kwargs):
+        fetch_started.set()
+        time.sleep(0.1)  # let the other threads queue up
+        return {"access_token": "fetched-token"}
+
+    fetch = mocker.patch.object(
+        client, "fetch_access_token", side_effect=fetch_access_token
+    )
+    results = []
+
+    def worker():
+        results.append(fetch_cc_token("scope1", rejected_token="rejected-token"))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fetch.call_count == 1
+    assert results == ["fetched-token"] * 8
+
+
+def test_fetch_cc_token_force(mocker):
+    client = get_oauth_client()
+    client.cc_token_cache = {
+        "scope1": {"access_token": "cached-token", "expires_at": None}
+    }
+    fetch = mocker.patch.object(
+        client, "fetch_access_token", return_value={"access_token": "fetched-token"}
+    )
+
+    assert fetch_cc_token("scope1") == "cached-token"
+    assert fetch_cc_token("scope1", rejected_token="other-token") == "cached-token"
+    assert fetch_cc_token("scope1", force=True) == "fetched-token"
+    assert fetch.call_count == 1
+
+
+def test_fetch_cc_token_shared(mocker, settings):
+    settings.NENS_AUTH_CC_TOKEN_CACHE = "default"
+    caches["default"].clear()
+    client = get_oauth_client()
+    fetch = mocker.patch.object(
+        client,
+        "fetch_access_token",
+        return_value={"access_token": "fetched-token", "expires_at": time.time() + 600},
+    )
+    set_m = mocker.spy(caches["default"], "set")
+
+    client.cc_token_cache = {}
+    assert fetch_cc_token("scope1") == "fetched-token"
+    # Another process (with an empty local cache) reuses the shared token
+    client.cc_token_cache = {}
+    assert fetch_cc_token("scope1") == "fetched-token"
+    assert fetch.call_count == 1
+    # The timeout is the time until expiry minus the refresh margin
+    assert 530 < set_m.call_args[1]["timeout"] <= 540
+
+    # A rejected token is fetched anew
+    fetch.return_value = {"access_token": "new-token"}
+    client.cc_token_cache = {}
+    assert fetch_cc_token("scope1", rejected_token="fetched-token") == "new-token"
+    caches["default"].clear()
+
+
+@pytest.mark.parametrize(
+    "scope,expected", [("b a", "a b"), (" a  b a ", "a b"), ("", "")]
+)
+def test_normalize_scope(scope, expected):
+    assert normalize_scope(scope) == expected
+
+
+def test_fetch_cc_token_normalized_scope(mocker):
+    client = get_oauth_client()
+    client.cc_token_cache = {}
+    fetch = mocker.patch.object(
+        client, "fetch_access_token", return_value={"access_token": "fetched-token"}
+    )
+
+    assert fetch_cc_token("b a") == "fetched-token"
+    assert fetch_cc_token("a b") == "fetched-token"
+    fetch.assert_called_once_with(grant_type="client_credentials", scope="a b")
+    assert client.cc_token_cache["a b"]["scope"] == "a b"
+
+
+@pytest.mark.parametrize("reuse", [True, False])
+def test_fetch_cc_token_superset(mocker, settings, reuse):
+    settings.NENS_AUTH_CC_TOKEN_REUSE_SUPERSET = reuse
+    client = get_oauth_client()
+    client.cc_token_cache = {}
+    fetch = mocker.patch.object(
+        client,
+        "fetch_access_token",
+        return_value={"access_token": "token-abc", "scope": "c b a"},
+    )
+    assert fetch_cc_token("a") == "token-abc"  # granted more than requested
+
+    fetch.return_value = {"access_token": "token-bc"}
+    assert fetch_cc_token("c b") == ("token-abc" if reuse else "token-bc")
+    # No cached token has scope "d"
+    fetch.return_value = {"access_token": "token-d"}
+    assert fetch_cc_token("d") == "token-d"
+
+
+def test_fetch_cc_token_superset_rejected(mocker, settings):
+    settings.NENS_AUTH_CC_TOKEN_REUSE_SUPERSET = True
+    client = get_oauth_client()
+    client.cc_token_cache = {
+        "a b": {"access_token": "token-ab", "expires_at": None, "scope": "a b"}
+    }
+    mocker.patch.object(
+        client, "fetch_access_token", return_value={"access_token": "token-a"}
+    )
+    assert fetch_cc_token("a") == "token-ab"
+    assert fetch_cc_token("a", rejected_token="token-ab") == "token-a"
+
+
+def test_shared_http_adapter(remote_user):
+    adapter = get_http_adapter()
+    assert get_http_adapter() is adapter
+    assert OAuth2Session(remote_user).adapters["https://"] is adapter
+
+    session = OAuth2Session(remote_user)
+    session.close()
+    assert session.adapters["http://"] is adapter
+    assert adapter.poolmanager is not None
+
+
+def test_shared_http_adapter_settings(settings):
+    settings.NENS_AUTH_HTTP_POOL_MAXSIZE = 32
+    settings.NENS_AUTH_HTTP_MAX_RETRIES = 3
+    settings.NENS_AUTH_HTTP_TCP_KEEPALIVE = True
+    adapter = get_http_adapter()
+
+    assert adapter.poolmanager.connection_pool_kw["maxsize"] == 32
+    assert adapter.max_retries.total == 3
+    assert (
+        socket.SOL_SOCKET,
+        socket.SO_KEEPALIVE,
+        1,
+    ) in adapter.poolmanager.connection_pool_kw["socket_options"]
+
+
+def test_shared_http_adapter_replaced(settings, mocker):
+    adapter = get_http_adapter()
+    close = mocker.patch.object(HTTPAdapter, "close")
+    settings.NENS_AUTH_HTTP_POOL_MAXSIZE = 32
+
+    assert get_http_adapter() is not adapter
+    close.assert_called_once_with(adapter)
+
+
+@pytest.mark.parametrize("timeout,expected", [(None, 5), (2, 2)])
+def test_shared_http_adapter_timeout(settings, mocker, timeout, expected):
+    settings.NENS_AUTH_HTTP_TIMEOUT = 5
+    send = mocker.patch.object(HTTPAdapter, "send")
+    get_http_adapter().send(mock.Mock(), timeout=timeout)
+    assert send.call_args[1]["timeout"] == expected
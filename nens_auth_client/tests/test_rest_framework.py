@@ -1,5 +1,10 @@
+from authlib.oidc.discovery import get_well_known_url
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from nens_auth_client.middleware import set_bearer_memo
+from nens_auth_client.oauth_base import BaseOAuthClient
 from nens_auth_client.rest_framework import OAuth2TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.test import APIRequestFactory
 
 import pytest
@@ -42,6 +47,26 @@ def test_authentication_class(
     assert auth.scope == "foo"
 
 
+def test_authentication_class_unknown_kid(
+    r, mocker, authenticator, access_token_generator, jwks_request, mocked_authenticate
+):
+    client = BaseOAuthClient(
+        "foo",
+        server_metadata_url=get_well_known_url(
+            settings.NENS_AUTH_ISSUER, external=True
+        ),
+    )
+    mocker.patch(
+        "nens_auth_client.rest_framework.authentication.get_oauth_client",
+        return_value=client,
+    )
+    r.META["HTTP_AUTHORIZATION"] = "Bearer " + access_token_generator(kid="unknown")
+
+    with pytest.raises(AuthenticationFailed):
+        authenticator.authenticate(r)
+    assert not mocked_authenticate.called
+
+
 def test_authentication_class_no_header(r, authenticator):
     assert authenticator.authenticate(r) is None
 
@@ -49,3 +74,41 @@ def test_authentication_class_no_header(r, authenticator):
 def test_authentication_class_no_bearer(r, authenticator, access_token_generator):
     r.META["HTTP_AUTHORIZATION"] = "Token xxx"
     assert authenticator.authenticate(r) is None
+
+
+def test_authentication_class_reuses_middleware_result(
+    r, authenticator, access_token_generator, mocked_oauth_client, mocked_authenticate
+):
+    token = access_token_generator()
+    r.META["HTTP_AUTHORIZATION"] = "Bearer " + token
+    middleware_user = UserModel(username="middlewareuser")
+    set_bearer_memo(r, token, {"scope": "bar"}, middleware_user)
+
+    user, auth = authenticator.authenticate(r)
+    assert user is middleware_user
+    assert auth.scope == "bar"
+    assert not mocked_oauth_client.parse_access_token.called
+    assert not mocked_authenticate.called
+
+
+def test_authentication_class_reuses_invalid_result(
+    r, authenticator, access_token_generator, mocked_oauth_client
+):
+    token = access_token_generator()
+    r.META["HTTP_AUTHORIZATION"] = "Bearer " + token
+    set_bearer_memo(r, token, None, None)
+
+    with pytest.raises(AuthenticationFailed):
+        authenticator.authenticate(r)
+    assert not mocked_oauth_client.parse_access_token.called
+
+
+def test_authentication_class_other_token(
+    r, authenticator, access_token_generator, mocked_oauth_client, mocked_authenticate
+):
+    r.META["HTTP_AUTHORIZATION"] = "Bearer " + access_token_generator()
+    set_bearer_memo(r, "other-token", None, None)
+
+    user, _ = authenticator.authenticate(r)
+    assert user.username == "testuser"
+    assert mocked_oauth_client.parse_access_token.called
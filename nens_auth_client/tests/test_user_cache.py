@@ -0,0 +1,77 @@
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from nens_auth_client import backends
+from nens_auth_client import user_cache
+from nens_auth_client.models import RemoteUser
+
+import pytest
+
+
+@pytest.fixture(params=[None, "default"])
+def cache_enabled(request, settings):
+    settings.NENS_AUTH_USER_CACHE_TIMEOUT = 60
+    settings.NENS_AUTH_USER_CACHE = request.param
+    yield
+    user_cache._local_cache.clear()
+    caches["default"].clear()
+
+
+@pytest.fixture
+def user_getter(mocker):
+    user_queryset = mocker.patch("nens_auth_client.backends._user_queryset")
+    user_queryset.return_value.get.return_value = User(id=1, username="testuser")
+    return user_queryset.return_value.get
+
+
+def test_disabled(user_getter):
+    for _ in range(2):
+        backends.RemoteUserBackend().authenticate(request=None, claims={"sub": "x"})
+    assert user_getter.call_count == 2
+
+
+def test_cached(user_getter, cache_enabled):
+    for _ in range(2):
+        user = backends.RemoteUserBackend().authenticate(
+            request=None, claims={"sub": "x"}
+        )
+    assert user_getter.call_count == 1
+    assert user.username == "testuser"
+    # a copy is returned
+    assert user is not user_getter.return_value
+
+
+def test_cached_async(mocker, cache_enabled):
+    user_queryset = mocker.patch("nens_auth_client.backends._user_queryset")
+    user_queryset.return_value.aget = mocker.AsyncMock(
+        return_value=User(id=1, username="testuser")
+    )
+    for _ in range(2):
+        user = async_to_sync(backends.RemoteUserBackend().aauthenticate)(
+            request=None, claims={"sub": "x"}
+        )
+    assert user_queryset.return_value.aget.await_count == 1
+    assert user.username == "testuser"
+
+
+def test_invalidate_remote_user(user_getter, cache_enabled):
+    backends.RemoteUserBackend().authenticate(request=None, claims={"sub": "x"})
+    user_cache._remote_user_changed(RemoteUser, RemoteUser(external_user_id="x"))
+    assert user_cache.get_cached_user("x") is None
+
+
+def test_invalidate_user(user_getter, cache_enabled, mocker):
+    remote_user_mgr = mocker.patch("nens_auth_client.user_cache.RemoteUser.objects")
+    remote_user_mgr.filter.return_value.values_list.return_value = ["x"]
+    backends.RemoteUserBackend().authenticate(request=None, claims={"sub": "x"})
+
+    user_cache._user_changed(User, user_getter.return_value)
+    assert user_cache.get_cached_user("x") is None
+    remote_user_mgr.filter.assert_called_once_with(user_id=1)
+
+
+def test_inactive_cached_user(user_getter, cache_enabled):
+    user_cache.set_cached_user("x", User(username="testuser", is_active=False))
+    with pytest.raises(backends.PermissionDenied):
+        backends.RemoteUserBackend().authenticate(request=None, claims={"sub": "x"})
+    assert not user_getter.called
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from django.db import IntegrityError
+from django.db.models import Q
 from nens_auth_client.users import create_remote_user
 from nens_auth_client.users import create_user
 from nens_auth_client.users import update_remote_user
@@ -20,6 +21,11 @@ def remoteuser_mgr(mocker):
     return mocker.patch("nens_auth_client.users.RemoteUser.objects")
 
 
+@pytest.fixture
+def tokens_mgr(mocker):
+    return mocker.patch("nens_auth_client.users.RemoteUserTokens.objects")
+
+
 @pytest.fixture
 def atomic_m(mocker):
     return mocker.patch("nens_auth_client.users.transaction.atomic")
@@ -107,7 +113,44 @@ def test_update_user(user_mgr, remoteuser_mgr, atomic_m):
     assert user.email == "test@test.com"
     assert user.first_name == "Lizard"
     assert user.last_name == "People"
-    assert user.save.called
+    user.save.assert_called_once_with(
+        update_fields=["first_name", "last_name", "email"]
+    )
+
+
+def test_update_user_partial(user_mgr, remoteuser_mgr, atomic_m):
+    user = User(first_name="Lizard", last_name="People", email="old@test.com")
+    with mock.patch.object(user, "save") as save:
+        update_user(
+            user,
+            {
+                "sub": "abc",
+                "email": "test@test.com",
+                "email_verified": True,
+                "given_name": "Lizard",
+                "family_name": "People",
+            },
+        )
+
+    assert user.email == "test@test.com"
+    save.assert_called_once_with(update_fields=["email"])
+
+
+def test_update_user_unchanged(user_mgr, remoteuser_mgr, atomic_m):
+    user = User(first_name="Lizard", last_name="People", email="test@test.com")
+    with mock.patch.object(user, "save") as save:
+        update_user(
+            user,
+            {
+                "sub": "abc",
+                "email": "test@test.com",
+                "email_verified": True,
+                "given_name": "Lizard",
+                "family_name": "People",
+            },
+        )
+
+    assert not save.called
 
 
 def test_update_user_trusted_provider(user_mgr, remoteuser_mgr, atomic_m, settings):
@@ -142,17 +185,63 @@ def test_update_user_no_fields(user_mgr, remoteuser_mgr, atomic_m):
     assert user.save.called
 
 
-def test_update_remote_user(remoteuser_mgr):
+def test_update_remote_user(remoteuser_mgr, tokens_mgr):
     update_remote_user(
         claims={"sub": "test-id"}, tokens={"id_token": "foo", "access_token": "bar"}
     )
-    remoteuser_mgr.filter.assert_called_with(external_user_id="test-id")
+    args, kwargs = remoteuser_mgr.filter.call_args
+    assert kwargs["external_user_id"] == "test-id"
     args, kwargs = remoteuser_mgr.filter.return_value.update.call_args
-    assert kwargs["id_token"] == "foo"
-    assert kwargs["access_token"] == "bar"
-    assert kwargs["refresh_token"] == ""
     assert isinstance(kwargs["last_modified"], datetime.datetime)
 
+    tokens_mgr.filter.assert_called_with(remote_user__external_user_id="test-id")
+    tokens_qs = tokens_mgr.filter.return_value
+    args, kwargs = tokens_qs.filter.return_value.update.call_args
+    assert kwargs == {"id_token": "foo", "access_token": "bar", "refresh_token": ""}
+    assert not tokens_mgr.get_or_create.called
+
+
+def test_update_remote_user_throttled(remoteuser_mgr, tokens_mgr, settings):
+    settings.NENS_AUTH_REMOTE_USER_UPDATE_INTERVAL = 300
+    update_remote_user(claims={"sub": "test-id"}, tokens={})
+
+    # last_modified is only updated if it is older than the interval
+    args, kwargs = remoteuser_mgr.filter.call_args
+    now = remoteuser_mgr.filter.return_value.update.call_args[1]["last_modified"]
+    assert kwargs["last_modified__lte"] == now - datetime.timedelta(seconds=300)
+
+
+def test_update_remote_user_tokens_unchanged(remoteuser_mgr, tokens_mgr):
+    tokens_qs = tokens_mgr.filter.return_value
+    tokens_qs.filter.return_value.update.return_value = 0
+    remoteuser_mgr.filter.return_value.values_list.return_value.first.return_value = 3
+    update_remote_user(
+        claims={"sub": "test-id"}, tokens={"id_token": "foo", "access_token": "bar"}
+    )
+
+    # Only update if a token changed
+    (changed,), _ = tokens_qs.filter.call_args
+    assert changed.connector == Q.OR
+    assert changed.children == [
+        ~Q(id_token="foo"),
+        ~Q(access_token="bar"),
+        ~Q(refresh_token=""),
+    ]
+    # If nothing was updated, create the tokens if they do not exist
+    tokens_mgr.get_or_create.assert_called_once_with(
+        remote_user_id=3,
+        defaults={"id_token": "foo", "access_token": "bar", "refresh_token": ""},
+    )
+
+
+def test_update_remote_user_no_tokens(remoteuser_mgr, tokens_mgr, settings):
+    settings.NENS_AUTH_STORE_TOKENS = False
+    update_remote_user(
+        claims={"sub": "test-id"}, tokens={"id_token": "foo", "access_token": "bar"}
+    )
+    assert tokens_mgr.filter.return_value.delete.called
+    assert not tokens_mgr.filter.return_value.filter.called
+
 
 def test_create_user_remoteuser_exists(user_mgr, remoteuser_mgr, atomic_m):
     user_mgr.create_user.side_effect = IntegrityError
@@ -109,6 +109,7 @@ MIDDLEWARE = (
 
 INSTALLED_APPS = (
     "nens_auth_client",
+    "nens_auth_client.user_indexes",
     "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
@@ -0,0 +1,94 @@
+"""Cache of users by external user id ("sub" claim), for RemoteUserBackend.
+
+The cache is disabled by default (NENS_AUTH_USER_CACHE_TIMEOUT = 0). Entries
+are invalidated when a RemoteUser or user is saved or deleted. Note that
+queryset updates (``.update()``) do not send signals and thus do not
+invalidate entries.
+"""
+
+from .cache import ExpiringLRUCache
+from .models import RemoteUser
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+import copy
+import hashlib
+import time
+
+# Max. amount of users in the local memory cache
+LOCAL_CACHE_SIZE = 1024
+
+_local_cache = ExpiringLRUCache(LOCAL_CACHE_SIZE)
+
+
+def _key(external_user_id):
+    digest = hashlib.sha256(external_user_id.encode()).hexdigest()
+    return "nens_auth_client:user:" + digest
+
+
+def get_cached_user(external_user_id):
+    """Return a (copy of the) cached user, or None"""
+    if not settings.NENS_AUTH_USER_CACHE_TIMEOUT:
+        return
+    if settings.NENS_AUTH_USER_CACHE:
+        user = caches[settings.NENS_AUTH_USER_CACHE].get(_key(external_user_id))
+    else:
+        user = _local_cache.get(_key(external_user_id))
+    if user is not None:
+        return copy.copy(user)
+
+
+def set_cached_user(external_user_id, user):
+    timeout = settings.NENS_AUTH_USER_CACHE_TIMEOUT
+    if not timeout:
+        return
+    if settings.NENS_AUTH_USER_CACHE:
+        caches[settings.NENS_AUTH_USER_CACHE].set(
+            _key(external_user_id), user, timeout=timeout
+        )
+    else:
+        _local_cache.set(_key(external_user_id), copy.copy(user), time.time() + timeout)
+
+
+async def aget_cached_user(external_user_id):
+    """Async version of ``get_cached_user``"""
+    if settings.NENS_AUTH_USER_CACHE:  # may do network I/O
+        return await sync_to_async(get_cached_user)(external_user_id)
+    return get_cached_user(external_user_id)
+
+
+async def aset_cached_user(external_user_id, user):
+    """Async version of ``set_cached_user``"""
+    if settings.NENS_AUTH_USER_CACHE:  # may do network I/O
+        await sync_to_async(set_cached_user)(external_user_id, user)
+    else:
+        set_cached_user(external_user_id, user)
+
+
+def invalidate_cached_user(external_user_id):
+    if settings.NENS_AUTH_USER_CACHE:
+        caches[settings.NENS_AUTH_USER_CACHE].delete(_key(external_user_id))
+    else:
+        _local_cache.delete(_key(external_user_id))
+
+
+@receiver(post_save, sender=RemoteUser)
+@receiver(post_delete, sender=RemoteUser)
+def _remote_user_changed(sender, instance, **kwargs):
+    if settings.NENS_AUTH_USER_CACHE_TIMEOUT:
+        invalidate_cached_user(instance.external_user_id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def _user_changed(sender, instance, **kwargs):
+    if not settings.NENS_AUTH_USER_CACHE_TIMEOUT:
+        return
+    for external_user_id in RemoteUser.objects.filter(user_id=instance.pk).values_list(
+        "external_user_id", flat=True
+    ):
+        invalidate_cached_user(external_user_id)
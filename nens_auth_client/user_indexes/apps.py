@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+from django.apps import AppConfig
+
+
+class UserIndexesConfig(AppConfig):
+    """Optional app that adds LOWER(email) and LOWER(username) indexes
+
+    These indexes are used by the backends that match users by email or
+    username (case-insensitively). The indexes are added to the table of
+    AUTH_USER_MODEL, which belongs to another app; that is why they are
+    created by a migration of this separate app.
+    """
+
+    name = "nens_auth_client.user_indexes"
+    label = "nens_auth_client_user_indexes"
+    verbose_name = "N&S authentication client user indexes"
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import migrations
+from django.db.models import Index
+from django.db.models.functions import Lower
+
+
+def get_indexes():
+    """Return the indexes on LOWER(email) and LOWER(username) of the user model"""
+    # Historical models lack these attributes: use the current user model
+    user_model = get_user_model()
+    email_field = user_model.get_email_field_name()
+    username_field = user_model.USERNAME_FIELD
+    return [
+        Index(Lower(email_field), name="nens_auth_user_email_lower"),
+        Index(Lower(username_field), name="nens_auth_user_username_lower"),
+    ]
+
+
+def add_indexes(apps, schema_editor):
+    model = apps.get_model(settings.AUTH_USER_MODEL)
+    for index in get_indexes():
+        schema_editor.add_index(model, index)
+
+
+def remove_indexes(apps, schema_editor):
+    model = apps.get_model(settings.AUTH_USER_MODEL)
+    for index in get_indexes():
+        schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(add_indexes, remove_indexes),
+    ]
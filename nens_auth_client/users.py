@@ -1,9 +1,12 @@
 from .models import RemoteUser
+from .models import RemoteUserTokens
 from .oauth import get_oauth_client
+from datetime import timedelta
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import IntegrityError
 from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 from typing import List
@@ -15,6 +18,9 @@ logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
+# The RemoteUserTokens fields that store the most recent tokens
+TOKEN_FIELDS = ("id_token", "access_token", "refresh_token")
+
 
 def found_or_wildcard(elem: str, allowed_elements: List[str]):
     return "*" in allowed_elements or elem in allowed_elements
@@ -101,34 +107,76 @@ def create_user(claims):
 def update_user(user, claims):
     """Update a User's metadata from ID token claims (Cognito)
 
+    The user is only saved if something changed, and then only the changed
+    fields are written.
+
     Args:
       user (User): the user to be udpated
       claims (dict): the (verified) payload of an AWS Cognito ID token
     """
-    user.first_name = claims.get("given_name", "")
-    user.last_name = claims.get("family_name", "")
     provider_name = get_oauth_client().extract_provider_name(claims)
     if claims.get("email_verified") or found_or_wildcard(
         provider_name, settings.NENS_AUTH_TRUSTED_PROVIDERS
     ):
-        user.email = claims.get("email", "")
+        email = claims.get("email", "")
     else:
-        user.email = ""
-    user.save()
+        email = ""
+    values = {
+        "first_name": claims.get("given_name", ""),
+        "last_name": claims.get("family_name", ""),
+        "email": email,
+    }
+    changed = [
+        field for (field, value) in values.items() if getattr(user, field) != value
+    ]
+    if not changed:
+        return
+    for field in changed:
+        setattr(user, field, values[field])
+    user.save(update_fields=changed)
 
 
 def update_remote_user(claims, tokens):
     """Update a RemoteUser's metadata from the tokens
 
+    "last_modified" is updated at most once per
+    NENS_AUTH_REMOTE_USER_UPDATE_INTERVAL seconds and the tokens are only
+    written if they changed. If NENS_AUTH_STORE_TOKENS is False, the tokens
+    are not stored (and existing ones are deleted).
+
     Args:
       claims (dict): the (verified) payload of an AWS Cognito ID token
       tokens (dict): the tokens (id_token, access_token, refresh_token)
     """
     external_id = claims["sub"]
-
-    RemoteUser.objects.filter(external_user_id=external_id).update(
-        id_token=tokens.get("id_token", ""),
-        access_token=tokens.get("access_token", ""),
-        refresh_token=tokens.get("refresh_token", ""),
-        last_modified=timezone.now(),
+    now = timezone.now()
+    RemoteUser.objects.filter(
+        external_user_id=external_id,
+        last_modified__lte=now
+        - timedelta(seconds=settings.NENS_AUTH_REMOTE_USER_UPDATE_INTERVAL),
+    ).update(last_modified=now)
+
+    remote_user_tokens = RemoteUserTokens.objects.filter(
+        remote_user__external_user_id=external_id
+    )
+    if not settings.NENS_AUTH_STORE_TOKENS:
+        remote_user_tokens.delete()
+        return
+
+    values = {field: tokens.get(field, "") for field in TOKEN_FIELDS}
+    changed = Q()
+    for field, value in values.items():
+        changed |= ~Q(**{field: value})
+    if remote_user_tokens.filter(changed).update(**values):
+        return
+
+    # The tokens did not change, or they were not stored before
+    remote_user_id = (
+        RemoteUser.objects.filter(external_user_id=external_id)
+        .values_list("pk", flat=True)
+        .first()
     )
+    if remote_user_id is not None:
+        RemoteUserTokens.objects.get_or_create(
+            remote_user_id=remote_user_id, defaults=values
+        )